@@ -1,16 +1,19 @@
 import rq
-import firebase_admin
+from functools import cached_property
 from flask import Flask
 from config import Config
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from flask_login import LoginManager
+from flask_login import LoginManager, user_logged_in
 from flask_moment import Moment
 from flask_mailman import Mail
-from firebase_admin import credentials
-from elasticsearch import Elasticsearch
-from redis import Redis
-from app.filters import markdown_filter
+from cachetools import TTLCache
+from app.filters import markdown_filter, srcset_filter
+from app.search import MemorySearchClient, create_search_backend
+from app.storage import create_storage
+from app.sessions import RedisSessionInterface
+from app.email import MailDispatcher
+from app.services import redis_client, elasticsearch_client, firebase_app, InstrumentedQueuePool
 
 db = SQLAlchemy()
 migrate = Migrate()
@@ -21,11 +24,56 @@ moment = Moment()
 mail = Mail()
 
 
+class ScratchApp(Flask):
+    @cached_property
+    def redis(self):
+        return redis_client(self.config)
+
+    @cached_property
+    def task_queue(self):
+        return rq.Queue('scratch-tasks', connection=self.redis)
+
+    @cached_property
+    def elasticsearch(self):
+        if self.config['ELASTICSEARCH_URL'] == 'memory://':
+            return MemorySearchClient()
+        if not self.config['ELASTICSEARCH_URL']:
+            return None
+        return elasticsearch_client(self.config)
+
+    @cached_property
+    def search_backend(self):
+        return create_search_backend(self)
+
+    @cached_property
+    def mail_dispatcher(self):
+        return MailDispatcher(self)
+
+    @cached_property
+    def storage(self):
+        if self.config['STORAGE_BACKEND'] == 'firebase':
+            firebase_app(self.config)
+        return create_storage(self)
+
+
+def _init_db(app):
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'poolclass': InstrumentedQueuePool,
+                                                   **app.config['SQLALCHEMY_ENGINE_OPTIONS']}
+    db.init_app(app)
+
+
+def _init_caches(app):
+    app.tile_cache = TTLCache(app.config['TILE_CACHE_SIZE'], app.config['TILE_CACHE_TTL'])
+    app.page_cache = TTLCache(app.config['CACHE_L1_SIZE'], app.config['CACHE_L1_TTL'])
+    app.user_cache = TTLCache(app.config['USER_CACHE_SIZE'], app.config['CACHE_L1_TTL'])
+
+
 def create_app():
-    app = Flask(__name__)
+    app = ScratchApp(__name__)
     app.config.from_object(Config)
 
-    db.init_app(app)
+    _init_db(app)
     migrate.init_app(app, db)
     login.init_app(app)
     moment.init_app(app)
@@ -40,17 +88,35 @@ def create_app():
     from app.main import bp as main_bp
     app.register_blueprint(main_bp)
 
-    cred = credentials.Certificate(app.config['GOOGLE_APPLICATION_CREDENTIALS'])
-    firebase_admin.initialize_app(cred, {
-        'storageBucket': app.config['FIREBASE_STORAGE_BUCKET']
-    })
-
-    app.redis = Redis.from_url(app.config['REDIS_URL'])
-    app.task_queue = rq.Queue('scratch-tasks', connection=app.redis)
+    _init_caches(app)
+    if app.config['SESSION_BACKEND'] == 'redis':
+        app.session_interface = RedisSessionInterface()
+        user_logged_in.connect(app.session_interface.regenerate, app)
 
-    app.elasticsearch = Elasticsearch(app.config['ELASTICSEARCH_URL']) \
-        if app.config['ELASTICSEARCH_URL'] else None
-    
     app.jinja_env.filters['markdown'] = markdown_filter
+    app.jinja_env.filters['srcset'] = srcset_filter
+
+    from app.cache import cached_include, prefetch_tiles, tile_fragment
+    app.jinja_env.globals['cached_include'] = cached_include
+    app.jinja_env.globals['prefetch_tiles'] = prefetch_tiles
+    app.jinja_env.globals['tile_fragment'] = tile_fragment
+
+    if app.config['METRICS_ENABLED']:
+        from app.instrumentation import init_instrumentation
+        init_instrumentation(app)
+
+    return app
+
+
+def create_worker_app():
+    app = ScratchApp(__name__)
+    app.config.from_object(Config)
+
+    _init_db(app)
+    mail.init_app(app)
+    _init_caches(app)
+
+    # jobs commit game and task changes, so the page cache invalidation listeners are needed here too
+    from app import cache
 
     return app
@@ -23,7 +23,7 @@ def login():
             flash('Invalid username or password', 'error')
             return redirect(url_for('auth.login'))
         if user.is_2fa_enabled:
-            session['username'] = user.username
+            session['user_id'] = user.id
             session['remember'] = form.remember.data
             return redirect(url_for('auth.verify_totp'))
         login_user(user, remember=form.remember.data)
@@ -34,14 +34,15 @@ def login():
 @bp.route('/login/verify-totp', methods=['GET', 'POST'])
 def verify_totp():
     form = TwoFactorAuthForm()
-    if 'username' not in session:
+    if 'user_id' not in session:
         return redirect(url_for('auth.login'))
-    user = db.session.scalar(db.select(User).where(User.username == session['username']))
+    user = db.session.get(User, session['user_id'])
     if not user:
         return redirect(url_for('auth.login'))
     if form.validate_on_submit():
         if user.verify_totp(form.token.data):
-            login_user(user, remember=session.get('remember', False))
+            session.pop('user_id')
+            login_user(user, remember=session.pop('remember', False))
             return redirect(url_for('main.index'))
         else:
             flash('Invalid OTP token', 'error')
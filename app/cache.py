@@ -0,0 +1,239 @@
+from datetime import datetime, timezone
+from functools import wraps
+from hashlib import sha1
+from threading import Lock
+from time import time
+from flask import current_app, g, request, session, make_response, render_template
+from flask_login import current_user
+from markupsafe import Markup
+from redis.exceptions import RedisError
+from app import db
+from app.models import User, Game, Upload, Screenshot, Comment, Task
+
+_lock = Lock()
+
+
+def _versions(dependencies):
+    known = g.setdefault('cache_versions', {})
+    missing = [name for name in dependencies if name not in known]
+    if missing:
+        values = current_app.redis.mget([f'cache:version:{name}' for name in missing])
+        known.update((name, int(value or 0)) for name, value in zip(missing, values))
+    return [known[name] for name in dependencies]
+
+
+def version_validators(dependencies):
+    try:
+        versions = _versions(dependencies)
+        values = current_app.redis.mget([f'cache:modified:{name}' for name in dependencies])
+    except RedisError:
+        current_app.logger.warning('Cache versions unavailable', exc_info=True)
+        return None
+    # only invalidate() writes these, so unknown ids and usernames never create keys
+    if None in values:
+        return None
+    modified = [float(value) for value in values]
+    return datetime.fromtimestamp(max(modified), timezone.utc), (versions, modified)
+
+
+def cache_key(name, dependencies=()):
+    versions = ','.join(f'{dependency}={version}' for dependency, version in
+                        zip(dependencies, _versions(dependencies)))
+    return 'cache:' + sha1(f'{name}|{versions}'.encode('utf-8')).hexdigest()
+
+
+def cache_get(key):
+    with _lock:
+        value = current_app.page_cache.get(key)
+    if value is None and key not in g.get('cache_misses', ()):
+        value = current_app.redis.get(key)
+        if value is not None:
+            value = value.decode('utf-8')
+            with _lock:
+                current_app.page_cache[key] = value
+    return value
+
+
+def cache_set(key, value, ttl):
+    g.get('cache_misses', set()).discard(key)
+    with _lock:
+        current_app.page_cache[key] = value
+    current_app.redis.set(key, value.encode('utf-8'), ex=ttl)
+
+
+def cached_fragment(name, render, dependencies=()):
+    try:
+        key = cache_key(name, dependencies)
+        value = cache_get(key)
+    except RedisError:
+        current_app.logger.warning('Fragment cache unavailable', exc_info=True)
+        return Markup(render())
+    if value is None:
+        value = render()
+        try:
+            cache_set(key, value, current_app.config['FRAGMENT_CACHE_TTL'])
+        except RedisError:
+            current_app.logger.warning('Fragment cache unavailable', exc_info=True)
+    return Markup(value)
+
+
+def cached_include(template_name, name, dependencies=(), **context):
+    return cached_fragment(name, lambda: render_template(template_name, **context), dependencies)
+
+
+def _tile_name(game):
+    return f'tile:{game.id}:{game.updated_at.timestamp()}'
+
+
+def prefetch_tiles(games):
+    try:
+        keys = [cache_key(_tile_name(game)) for game in games]
+        with _lock:
+            missing = [key for key in keys if key not in current_app.page_cache]
+        if missing:
+            values = current_app.redis.mget(missing)
+            misses = g.setdefault('cache_misses', set())
+            with _lock:
+                for key, value in zip(missing, values):
+                    if value is not None:
+                        current_app.page_cache[key] = value.decode('utf-8')
+                    else:
+                        misses.add(key)
+    except RedisError:
+        current_app.logger.warning('Fragment cache unavailable', exc_info=True)
+    return ''
+
+
+def tile_fragment(game):
+    return cached_include('game_tile.html', _tile_name(game), game=game)
+
+
+def cached_page(dependencies):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not current_app.config['PAGE_CACHE_TTL'] or request.method != 'GET' or \
+                    current_user.is_authenticated or session.get('_flashes'):
+                return f(*args, **kwargs)
+            try:
+                key = cache_key(f'page:{request.full_path}', dependencies(*args, **kwargs))
+                body = cache_get(key)
+            except RedisError:
+                current_app.logger.warning('Page cache unavailable', exc_info=True)
+                return f(*args, **kwargs)
+            if body is not None:
+                response = make_response(body)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200 and response.mimetype == 'text/html':
+                try:
+                    cache_set(key, response.get_data(as_text=True), current_app.config['PAGE_CACHE_TTL'])
+                except RedisError:
+                    current_app.logger.warning('Page cache unavailable', exc_info=True)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return decorated_function
+    return decorator
+
+
+def _etag(last_modified, seed):
+    if current_user.is_authenticated:
+        # Rotate the ETag for signed-in users so a revalidated page never carries an expired CSRF token
+        limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+        viewer = f'{current_user.id}:{int(time() // (limit / 2)) if limit else 0}'
+    else:
+        viewer = 'anonymous'
+    value = f'{viewer}|{request.full_path}|{last_modified.isoformat()}|{seed}'
+    return sha1(value.encode('utf-8')).hexdigest()
+
+
+def _cache_headers(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    if current_user.is_authenticated:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['HTTP_CACHE_MAX_AGE']
+    response.vary.add('Cookie')
+    return response
+
+
+def conditional(validators):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != 'GET' or session.get('_flashes'):
+                return f(*args, **kwargs)
+            result = validators(*args, **kwargs)
+            if result is None:
+                return f(*args, **kwargs)
+            last_modified, seed = result
+            if last_modified.tzinfo is None:
+                last_modified = last_modified.replace(tzinfo=timezone.utc)
+            last_modified = last_modified.replace(microsecond=0)
+            etag = _etag(last_modified, seed)
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = request.if_modified_since is not None and \
+                    last_modified <= request.if_modified_since and not current_user.is_authenticated
+            if not_modified:
+                return _cache_headers(current_app.response_class(status=304), etag, last_modified)
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                _cache_headers(response, etag, last_modified)
+            return response
+        return decorated_function
+    return decorator
+
+
+def invalidate(*dependencies):
+    g.pop('cache_versions', None)
+    now = time()
+    pipeline = current_app.redis.pipeline(transaction=False)
+    for name in dependencies:
+        pipeline.incr(f'cache:version:{name}')
+        pipeline.set(f'cache:modified:{name}', now)
+    pipeline.execute()
+
+
+def _dependencies(obj):
+    if isinstance(obj, Game):
+        return ['games', f'game:{obj.id}']
+    if isinstance(obj, (Upload, Screenshot, Comment)):
+        return [f'game:{obj.game_id}']
+    if isinstance(obj, Task) and obj.game_id:
+        return [f'game:{obj.game_id}']
+    if isinstance(obj, User):
+        return [f'user:{obj.username}']
+    return []
+
+
+def _after_flush(session, flush_context):
+    changed = session.info.setdefault('cache_changes', set())
+    for obj in (*session.new, *session.deleted):
+        changed.update(_dependencies(obj))
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            changed.update(_dependencies(obj))
+
+
+def _after_commit(session):
+    changed = session.info.pop('cache_changes', None)
+    if changed:
+        try:
+            invalidate(*changed)
+        except RedisError:
+            current_app.logger.warning('Could not invalidate page cache', exc_info=True)
+
+
+def _after_rollback(session):
+    session.info.pop('cache_changes', None)
+
+
+db.event.listen(db.session, 'after_flush', _after_flush)
+db.event.listen(db.session, 'after_commit', _after_commit)
+db.event.listen(db.session, 'after_rollback', _after_rollback)
@@ -1,14 +1,121 @@
-from threading import Thread
+import os
+import atexit
+from queue import Queue, Empty, Full
+from threading import Thread, Lock
+from time import monotonic, sleep
 from flask import current_app
 from flask_mailman import EmailMultiAlternatives
 
 
-def _send_async_email(app, msg):
-    with app.app_context():
-        msg.send()
+class MailDispatcher:
+    def __init__(self, app):
+        self.app = app
+        self.queue = Queue(maxsize=app.config['MAIL_QUEUE_SIZE'])
+        self.lock = Lock()
+        self.thread = None
+        self.pid = None
+        self.closed = False
+        self.registered = False
+        self.counters = {'sent': 0, 'failed': 0, 'retries': 0, 'batches': 0, 'latency': 0.0, 'max_latency': 0.0}
+
+    def _ensure_worker(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive() or self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.thread = Thread(target=self._run, name='mail-dispatcher', daemon=True)
+                self.thread.start()
+                if not self.registered:
+                    atexit.register(self.shutdown)
+                    self.registered = True
+
+    def send(self, msg):
+        if self.closed:
+            msg.send()
+            return
+        self._ensure_worker()
+        try:
+            self.queue.put((msg, monotonic()), timeout=self.app.config['MAIL_QUEUE_TIMEOUT'])
+        except Full:
+            self.app.logger.warning('Mail queue is full, sending message synchronously')
+            msg.send()
+
+    def join(self):
+        self.queue.join()
+
+    def shutdown(self):
+        self.closed = True
+        deadline = monotonic() + self.app.config['MAIL_SHUTDOWN_TIMEOUT']
+        while self.queue.unfinished_tasks and monotonic() < deadline:
+            sleep(0.1)
+        if self.queue.unfinished_tasks:
+            self.app.logger.error(f'Dropping {self.queue.unfinished_tasks} queued emails on shutdown')
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        stats['queued'] = self.queue.qsize()
+        stats['latency'] = stats['latency'] / stats['sent'] if stats['sent'] else 0.0
+        return stats
+
+    def _count(self, **counters):
+        with self.lock:
+            for key, value in counters.items():
+                self.counters[key] += value
+
+    def _run(self):
+        connection = None
+        with self.app.app_context():
+            while True:
+                try:
+                    batch = [self.queue.get(timeout=self.app.config['MAIL_IDLE_TIMEOUT'])]
+                except Empty:
+                    if connection is not None:
+                        self._close(connection)
+                        connection = None
+                    continue
+                while len(batch) < self.app.config['MAIL_BATCH_SIZE']:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except Empty:
+                        break
+                self._count(batches=1)
+                for msg, queued_at in batch:
+                    connection = self._deliver(msg, queued_at, connection)
+                    self.queue.task_done()
+
+    def _deliver(self, msg, queued_at, connection):
+        retries = self.app.config['MAIL_RETRIES']
+        for attempt in range(retries + 1):
+            try:
+                if connection is None:
+                    connection = current_app.extensions['mailman'].get_connection()
+                    connection.open()
+                connection.send_messages([msg])
+                latency = monotonic() - queued_at
+                with self.lock:
+                    self.counters['sent'] += 1
+                    self.counters['latency'] += latency
+                    self.counters['max_latency'] = max(self.counters['max_latency'], latency)
+                return connection
+            except Exception:
+                if connection is not None:
+                    self._close(connection)
+                    connection = None
+                if attempt == retries:
+                    self.app.logger.error(f'Could not send email to {", ".join(msg.to)}', exc_info=True)
+                    self._count(failed=1)
+                    return None
+                self._count(retries=1)
+                sleep(self.app.config['MAIL_RETRY_BACKOFF'] * 2 ** attempt)
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            self.app.logger.warning('Could not close SMTP connection', exc_info=True)
 
 
-def send_email(subject, sender, recipients, body, html, attachments, sync):
+def send_email(subject, sender, recipients, body, html, attachments=None, sync=False):
     msg = EmailMultiAlternatives(subject, body, sender, recipients)
     msg.attach_alternative(html, 'text/html')
     if attachments:
@@ -17,4 +124,4 @@ def send_email(subject, sender, recipients, body, html, attachments, sync):
     if sync:
         msg.send()
     else:
-        Thread(target=_send_async_email, args=(current_app._get_current_object(), msg)).start()
+        current_app.mail_dispatcher.send(msg)
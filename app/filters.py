@@ -1,5 +1,32 @@
-from markdown import markdown
+from hashlib import sha256
+from threading import Lock, local
+import nh3
+from cachetools import LRUCache
+from markdown import Markdown
+
+_converters = local()
+_rendered = LRUCache(maxsize=1024)
+_lock = Lock()
+
+
+def render_markdown(text):
+    converter = getattr(_converters, 'markdown', None)
+    if converter is None:
+        converter = _converters.markdown = Markdown()
+    return nh3.clean(converter.reset().convert(text))
 
 
 def markdown_filter(text):
-    return markdown(text)
+    digest = sha256(text.encode('utf-8')).digest()
+    with _lock:
+        html = _rendered.get(digest)
+    if html is None:
+        html = render_markdown(text)
+        with _lock:
+            _rendered[digest] = html
+    return html
+
+
+def srcset_filter(variants, image_format):
+    return ', '.join(f'{url} {width}w' for width, url in
+                     sorted(variants[image_format].items(), key=lambda variant: int(variant[0])))
@@ -0,0 +1,67 @@
+from io import BytesIO
+from flask import current_app
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+class ImageError(Exception):
+    pass
+
+
+def check_image(path, label):
+    max_pixels = current_app.config['IMAGE_MAX_PIXELS']
+    too_large = ImageError(f'{label} may be at most {max_pixels // 1000000} megapixels')
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+            image.verify()
+    except Image.DecompressionBombError:
+        raise too_large
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        raise ImageError(f'{label} is not a valid image')
+    if width * height > max_pixels:
+        raise too_large
+
+
+def _resize(image, width):
+    if image.width <= width:
+        return image
+    return image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+
+
+def _flatten(image):
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def image_variants(storage, source_path, key):
+    widths = current_app.config['IMAGE_VARIANT_WIDTHS']
+    try:
+        with Image.open(source_path) as source:
+            image = _flatten(ImageOps.exif_transpose(source))
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        current_app.logger.warning(f'Could not generate image variants for {key}', exc_info=True)
+        return None
+
+    widths = sorted({min(width, image.width) for width in widths})
+    variants = {}
+    for name, (image_format, content_type, options) in FORMATS.items():
+        variants[name] = {}
+        for width in widths:
+            path = f'variants/{key[:2]}/{key}/{width}.{name}'
+            if not storage.exists(path):
+                buffer = BytesIO()
+                _resize(image, width).save(buffer, image_format, **options)
+                size = buffer.tell()
+                buffer.seek(0)
+                storage.put(path, buffer, content_type, size)
+            variants[name][str(width)] = storage.public_url(path)
+    return variants
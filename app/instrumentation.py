@@ -0,0 +1,228 @@
+import os
+import hmac
+import json
+import heapq
+import random
+import cProfile
+from collections import defaultdict
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter, strftime
+from flask import g, request, abort, has_app_context, current_app, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+COMPONENTS = ('sql', 'redis', 'search', 'storage', 'template')
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_lock = Lock()
+_profiler_lock = Lock()
+_requests = defaultdict(int)
+_durations = defaultdict(lambda: [0] * (len(BUCKETS) + 1))
+_duration_sums = defaultdict(float)
+_component_sums = defaultdict(float)
+_component_counts = defaultdict(int)
+_slowest = []
+
+
+def _timings():
+    if has_app_context():
+        return g.get('timings')
+    return None
+
+
+def record(component, duration):
+    timings = _timings()
+    if timings is not None:
+        timings[component] += duration
+        g.counts[component] += 1
+
+
+@contextmanager
+def timed(component):
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        record(component, perf_counter() - start)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record('sql', perf_counter() - conn.info['query_start'].pop())
+
+
+def _before_render_template(app, template, context):
+    if 'template_starts' in g:
+        g.template_starts.append(perf_counter())
+
+
+def _template_rendered(app, template, context):
+    starts = g.get('template_starts')
+    if starts:
+        start = starts.pop()
+        if not starts:
+            record('template', perf_counter() - start)
+
+
+def _before_request():
+    g.timings = defaultdict(float)
+    g.counts = defaultdict(int)
+    g.template_starts = []
+    g.request_start = perf_counter()
+    # only one profiler can be active per process, concurrent sampled requests are skipped
+    if random.random() < current_app.config['PROFILE_SAMPLE_RATE'] and _profiler_lock.acquire(blocking=False):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            _profiler_lock.release()
+            return
+        g.profiler = profiler
+
+
+def _dump_profile(profiler, endpoint, duration):
+    directory = current_app.config['PROFILE_DIR']
+    with _lock:
+        if len(_slowest) >= current_app.config['PROFILE_KEEP'] and duration <= _slowest[0][0]:
+            return
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{strftime("%Y%m%d-%H%M%S")}-{endpoint}-{duration * 1000:.0f}ms.prof')
+        profiler.dump_stats(path)
+        heapq.heappush(_slowest, (duration, path))
+        if len(_slowest) > current_app.config['PROFILE_KEEP']:
+            _, evicted = heapq.heappop(_slowest)
+            try:
+                os.unlink(evicted)
+            except OSError:
+                pass
+
+
+def _after_request(response):
+    if 'request_start' not in g:
+        return response
+    duration = perf_counter() - g.request_start
+    endpoint = request.endpoint or 'unknown'
+    if 'profiler' in g:
+        try:
+            g.profiler.disable()
+        finally:
+            _profiler_lock.release()
+        _dump_profile(g.pop('profiler'), endpoint, duration)
+
+    metrics = [f'{component};dur={g.timings[component] * 1000:.1f};desc="{g.counts[component]} calls"'
+               for component in COMPONENTS if g.counts[component]]
+    metrics.append(f'total;dur={duration * 1000:.1f}')
+    response.headers.add('Server-Timing', ', '.join(metrics))
+
+    with _lock:
+        _requests[(endpoint, request.method, response.status_code)] += 1
+        _duration_sums[endpoint] += duration
+        buckets = _durations[endpoint]
+        for index, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                buckets[index] += 1
+        buckets[-1] += 1
+        for component in COMPONENTS:
+            _component_sums[(endpoint, component)] += g.timings[component]
+            _component_counts[(endpoint, component)] += g.counts[component]
+
+    current_app.logger.info(json.dumps({
+        'event': 'request',
+        'method': request.method,
+        'path': request.path,
+        'endpoint': endpoint,
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 1),
+        **{f'{component}_ms': round(g.timings[component] * 1000, 1) for component in COMPONENTS},
+        **{f'{component}_calls': g.counts[component] for component in COMPONENTS}
+    }))
+    return response
+
+
+def _teardown_request(exception):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        try:
+            profiler.disable()
+        finally:
+            _profiler_lock.release()
+
+
+def _sample(name, labels, value):
+    if labels:
+        label_str = ','.join(f'{key}="{str(label).replace(chr(34), chr(39))}"' for key, label in labels.items())
+        return f'{name}{{{label_str}}} {value}'
+    return f'{name} {value}'
+
+
+def _service_metrics():
+    from app import db
+    from app.models import SearchableMixin
+    from app.search import query_cache_stats
+    from app.services import pool_stats
+    lines = []
+    for service, stats in pool_stats(current_app, db.engine).items():
+        for key, value in stats.items():
+            lines.append(_sample(f'scratch_pool_{key}', {'service': service}, value))
+    for key, value in current_app.mail_dispatcher.stats().items():
+        lines.append(_sample(f'scratch_mail_{key}', {}, value))
+    try:
+        for cls in SearchableMixin.__subclasses__():
+            for key, value in query_cache_stats(cls.__tablename__).items():
+                lines.append(_sample(f'scratch_search_cache_{key}_total', {'index': cls.__tablename__}, value))
+    except Exception:
+        current_app.logger.warning('Could not read search cache stats', exc_info=True)
+    return lines
+
+
+def metrics_authorized():
+    token = current_app.config['METRICS_TOKEN']
+    if not current_app.config['METRICS_ENABLED'] or not token:
+        return False
+    return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+
+
+def metrics():
+    if not metrics_authorized():
+        abort(404)
+    lines = ['# TYPE scratch_requests_total counter']
+    with _lock:
+        for (endpoint, method, status), count in sorted(_requests.items()):
+            lines.append(_sample('scratch_requests_total', {'endpoint': endpoint, 'method': method, 'status': status},
+                                 count))
+        lines.append('# TYPE scratch_request_duration_seconds histogram')
+        for endpoint, buckets in sorted(_durations.items()):
+            for bound, count in zip(BUCKETS, buckets):
+                lines.append(_sample('scratch_request_duration_seconds_bucket', {'endpoint': endpoint, 'le': bound},
+                                     count))
+            lines.append(_sample('scratch_request_duration_seconds_bucket', {'endpoint': endpoint, 'le': '+Inf'},
+                                 buckets[-1]))
+            lines.append(_sample('scratch_request_duration_seconds_sum', {'endpoint': endpoint},
+                                 _duration_sums[endpoint]))
+            lines.append(_sample('scratch_request_duration_seconds_count', {'endpoint': endpoint}, buckets[-1]))
+        lines.append('# TYPE scratch_component_duration_seconds_total counter')
+        for (endpoint, component), value in sorted(_component_sums.items()):
+            lines.append(_sample('scratch_component_duration_seconds_total',
+                                 {'endpoint': endpoint, 'component': component}, value))
+        lines.append('# TYPE scratch_component_calls_total counter')
+        for (endpoint, component), value in sorted(_component_counts.items()):
+            lines.append(_sample('scratch_component_calls_total', {'endpoint': endpoint, 'component': component},
+                                 value))
+    lines.extend(_service_metrics())
+    return '\n'.join(lines) + '\n', 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
+def init_instrumentation(app):
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_before_render_template, app)
+    template_rendered.connect(_template_rendered, app)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule('/metrics', 'metrics', metrics)
@@ -1,17 +1,23 @@
 import os
 import json
 import uuid
-import tempfile
 import zipfile
-import mimetypes
-from flask import render_template, redirect, url_for, flash, current_app, request, g
+from flask import render_template, redirect, url_for, flash, current_app, request, g, abort, send_file
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
-from firebase_admin import storage
+from sqlalchemy.orm import selectinload, joinedload
 from app import db
 from app.main import bp
 from app.main.forms import ProfileSettingsForm, EditGameForm, CommentForm, SearchForm, EmptyForm
-from app.models import User, Game, Upload, Screenshot, Tag, Comment
+from app.models import User, Game, Upload, Screenshot, Tag, Comment, Task
+from app.pagination import keyset_paginate
+from app.storage import LocalStorage
+from app.uploads import stage_game_files, discard_staged_files, WebBuildError
+from app.images import ImageError
+from app.tiles import search_tiles
+from app.cache import cached_page, conditional, version_validators
+from app.services import pool_stats
+from app.instrumentation import metrics_authorized
+from app.tags import parse_tags, upsert_tags, tag_games_query, tag_count
 
 
 @bp.before_app_request
@@ -19,10 +25,54 @@ def before_requrest():
     g.search_form = SearchForm()
 
 
+def _game_feed(tag=None):
+    query = tag_games_query(tag) if tag else db.select(Game).where(Game.processing == False)
+    query = query.options(selectinload(Game.tags))
+    return keyset_paginate(query, Game, request.args.get('cursor'), current_app.config['GAMES_PER_PAGE'])
+
+
+def _feed_validators():
+    return version_validators(['games'])
+
+
+def _tag_validators(name):
+    return version_validators(['games']) if tag_count(name) else None
+
+
+def _user_validators(username):
+    return version_validators(['games', f'user:{username}'])
+
+
+def _game_validators(id, slug):
+    return version_validators([f'game:{id}'])
+
+
 @bp.route('/')
+@conditional(_feed_validators)
+@cached_page(lambda: ['games'])
 def index():
-    games = db.session.scalars(db.select(Game).order_by(Game.created_at.desc())).all()
-    return render_template('index.html', games=games)
+    games, next_cursor = _game_feed()
+    return render_template('index.html', games=games, next_cursor=next_cursor)
+
+
+@bp.route('/feed')
+def feed():
+    tag = request.args.get('tag')
+    games, next_cursor = _game_feed(tag)
+    return {
+        'html': render_template('game_tiles.html', games=games),
+        'next_url': url_for('main.feed', tag=tag, cursor=next_cursor) if next_cursor else None
+    }
+
+
+@bp.route('/tag/<name>')
+@conditional(_tag_validators)
+@cached_page(lambda name: ['games'])
+def tag(name):
+    games, next_cursor = _game_feed(name)
+    if not games and not request.args.get('cursor'):
+        db.first_or_404(db.select(Tag).where(Tag.name == name))
+    return render_template('tag.html', name=name, count=tag_count(name), games=games, next_cursor=next_cursor)
 
 
 @bp.route('/search')
@@ -30,7 +80,7 @@ def search():
     if not g.search_form.validate():
         return redirect(url_for('main.index'))
     page = request.args.get('page', 1, type=int)
-    games, total = Game.search(g.search_form.q.data, page, current_app.config['RESULTS_PER_PAGE'])
+    games, total = search_tiles(g.search_form.q.data, page, current_app.config['RESULTS_PER_PAGE'])
     next_url = url_for('main.search', q=g.search_form.q.data, page=page + 1) \
         if total > page * current_app.config['RESULTS_PER_PAGE'] else None
     prev_url = url_for('main.search', q=g.search_form.q.data, page=page - 1) \
@@ -38,10 +88,43 @@ def search():
     return render_template('search.html', games=games, next_url=next_url, prev_url=prev_url)
 
 
+@bp.route('/files/<path:path>')
+def storage_file(path):
+    if not isinstance(current_app.storage, LocalStorage) or path.startswith('exports/'):
+        abort(404)
+    return current_app.storage.send(path)
+
+
+@bp.route('/internal/pools')
+def pools():
+    if not metrics_authorized():
+        abort(404)
+    return pool_stats(current_app, db.engine)
+
+
+@bp.route('/internal/mail')
+def mail_stats():
+    if not metrics_authorized():
+        abort(404)
+    return current_app.mail_dispatcher.stats()
+
+
+@bp.route('/data-export/<token>')
+def download_data_export(token):
+    path = User.verify_data_export_token(token)
+    if not path or not current_app.storage.exists(path):
+        abort(404)
+    return send_file(current_app.storage.stream(path), mimetype='application/gzip', as_attachment=True,
+                     download_name='scratch-data-export.ndjson.gz')
+
+
 @bp.route('/user/<username>')
+@conditional(_user_validators)
+@cached_page(lambda username: ['games', f'user:{username}'])
 def user(username):
     user = db.first_or_404(db.select(User).where(User.username == username))
-    games = db.session.scalars(user.games.select().order_by(Game.created_at.desc())).all()
+    games = db.session.scalars(user.games.select().where(Game.processing == False)
+                             .order_by(Game.created_at.desc())).all()
     return render_template('user.html', user=user, games=games)
 
 
@@ -73,22 +156,67 @@ def request_data_export():
         flash('An export task is currently in progress')
     else:
         flash('Started data export...')
-        current_user.launch_task('export_data', 'Exporting data...')
+        path = f'exports/{current_user.id}/{uuid.uuid4()}.ndjson.gz'
+        download_url = url_for('main.download_data_export', token=current_user.get_data_export_token(path),
+                               _external=True)
+        current_user.launch_task('export_data', 'Exporting data...', path, download_url)
         db.session.commit()
     return redirect(url_for('main.export_data'))
 
+def _game_files(game):
+    uploads = db.session.scalars(db.select(Upload).where(Upload.game_id == game.id)).all()
+    screenshots = db.session.scalars(db.select(Screenshot).where(Screenshot.game_id == game.id)
+                                     .order_by(Screenshot.order.asc())).all()
+    return uploads, screenshots
+
+
+def _game_comments(game, cursor=None):
+    query = db.select(Comment).where(Comment.game_id == game.id).options(joinedload(Comment.author))
+    return keyset_paginate(query, Comment, cursor, current_app.config['COMMENTS_PER_PAGE'])
+
+
 @bp.route('/game/<id>', defaults={'slug': None})
 @bp.route('/game/<id>/<slug>')
+@conditional(_game_validators)
+@cached_page(lambda id, slug: [f'game:{id}'])
 def game(id, slug):
-    game = db.first_or_404(db.select(Game).where(Game.id == id))
+    game = db.first_or_404(db.select(Game).where(Game.id == id)
+                           .options(joinedload(Game.creator), selectinload(Game.tags)))
     if not slug or slug != game.slug:
         return redirect(url_for('main.game', id=game.id, slug=game.slug))
-    uploads = db.session.scalars(game.uploads.select()).all()
-    screenshots = db.session.scalars(game.screenshots.select().order_by(Screenshot.order.asc())).all()
-    comments = db.session.scalars(game.comments.select().order_by(Comment.created_at.desc())).all()
+    uploads, screenshots = _game_files(game)
+    comments, next_cursor = _game_comments(game, request.args.get('comments'))
+    task = db.session.scalar(db.select(Task).where(Task.game_id == game.id).order_by(Task.complete)) \
+        if game.processing else None
     comment_form = CommentForm()
     delete_comment_form = EmptyForm()
-    return render_template('game.html', game=game, uploads=uploads, screenshots=screenshots, comments=comments, comment_form=comment_form, delete_comment_form=delete_comment_form)
+    return render_template('game.html', game=game, uploads=uploads, screenshots=screenshots, comments=comments, next_cursor=next_cursor, task=task, comment_form=comment_form, delete_comment_form=delete_comment_form, sandbox_web_builds=current_app.storage.same_origin)
+
+
+@bp.route('/game/<id>/comments')
+def game_comments(id):
+    game = db.first_or_404(db.select(Game).where(Game.id == id).options(joinedload(Game.creator)))
+    comments, next_cursor = _game_comments(game, request.args.get('cursor'))
+    return {
+        'html': render_template('game_comments.html', game=game, comments=comments,
+                                delete_comment_form=EmptyForm()),
+        'next_url': url_for('main.game_comments', id=game.id, cursor=next_cursor) if next_cursor else None
+    }
+
+
+@bp.route('/game/<id>/progress')
+def game_progress(id):
+    game = db.first_or_404(db.select(Game).where(Game.id == id))
+    task = db.session.scalar(db.select(Task).where(Task.game_id == game.id).order_by(Task.complete))
+    if not task:
+        return {'processing': game.processing}
+    return {
+        'processing': game.processing,
+        'state': task.state,
+        'bytes_done': task.bytes_done,
+        'bytes_total': task.bytes_total,
+        'files_done': task.files_done
+    }
 
 
 @bp.route('/game/new', methods=['GET', 'POST'])
@@ -100,80 +228,41 @@ def new_game():
             flash('Cover image is required')
             return render_template('edit_game.html', form=form)
 
+        uploads_metadata = json.loads(form.uploads_metadata.data)
+        for index, upload_file in enumerate(form.uploads.data or []):
+            if uploads_metadata[index].get('is_web_build', False) and \
+                    os.path.splitext(upload_file.filename)[1] != '.zip':
+                flash('Only .zip files are allowed for web builds', 'error')
+                return render_template('edit_game.html', form=form)
+
+        try:
+            manifest = stage_game_files(str(uuid.uuid4()), form.uploads.data, uploads_metadata,
+                                        form.cover.data, form.screenshots.data)
+        except zipfile.BadZipFile:
+            flash('Web builds must be valid .zip files', 'error')
+            return render_template('edit_game.html', form=form)
+        except (WebBuildError, ImageError) as error:
+            flash(str(error), 'error')
+            return render_template('edit_game.html', form=form)
+
         game = Game(
             title=form.title.data,
             tagline=form.tagline.data,
             description=form.description.data,
-            creator=current_user)
-
-        folder = uuid.uuid4()
-        bucket = storage.bucket()
-
-        uploads_metadata = json.loads(form.uploads_metadata.data)
-        uploads = form.uploads.data
-        if uploads:
-            for index, upload_file in enumerate(uploads):
-                upload_filename = secure_filename(upload_file.filename)
-                is_web_build = uploads_metadata[index].get('is_web_build', False)
-
-                if is_web_build:
-                    if os.path.splitext(upload_file.filename)[1] != '.zip':
-                        flash('Only .zip files are allowed for web builds', 'error')
-                        return render_template('edit_game.html', form=form)
-
-                    with tempfile.TemporaryDirectory() as tmp_dir:
-                        upload_filepath = os.path.join(tmp_dir, upload_filename)
-                        upload_file.save(upload_filepath)
-                        with zipfile.ZipFile(upload_filepath) as zip_file:
-                            zip_file.extractall(tmp_dir)
-                        os.unlink(upload_filepath)
-
-                        for root, _, files in os.walk(tmp_dir):
-                            for file in files:
-                                filepath = os.path.join(root, file)
-                                relpath = os.path.relpath(filepath, start=tmp_dir)
-                                with open(filepath, 'rb') as file_data:
-                                    blob = bucket.blob(f'{folder}/uploads/web/{relpath}')
-                                    blob.upload_from_file(file_data, content_type=mimetypes.guess_type(filepath)[0])
-
-                                    if relpath == 'index.html':
-                                        upload = Upload(url=blob.public_url, filename=relpath, game=game, is_web_build=True, size=0)
-                                        db.session.add(upload)
-                else:
-                    bytes = upload_file.read()
-                    blob = bucket.blob(f'{folder}/uploads/{upload_filename}')
-                    blob.upload_from_string(bytes, content_type=upload_file.mimetype)
-                    upload = Upload(url=blob.public_url, filename=upload_filename, game=game, is_web_build=False, size=len(bytes))
-                    db.session.add(upload)
-
-        cover_file = form.cover.data
-        if cover_file:
-            blob = bucket.blob(f'{folder}/cover{os.path.splitext(cover_file.filename)[1]}')
-            blob.upload_from_string(cover_file.read(), content_type=cover_file.mimetype)
-            game.cover_url = blob.public_url
-
-        if form.screenshots.data:
-            for index, screenshot_file in enumerate(form.screenshots.data):
-                blob = bucket.blob(f'{folder}/screenshots/{index}{os.path.splitext(screenshot_file.filename)[1]}')
-                blob.upload_from_string(screenshot_file.read(), content_type=screenshot_file.mimetype)
-                screenshot = Screenshot(url=blob.public_url, order=index, game=game)
-                db.session.add(screenshot)
-
-        tags_str = form.tags.data
-        if tags_str:
-            tags = {tag.strip() for tag in tags_str.lower().split(',') if tag.strip()}
-
-            for tag_name in tags:
-                tag = Tag.query.filter_by(name=tag_name).first()
-                if not tag:
-                    tag = Tag(name=tag_name)
-                    db.session.add(tag)
-                game.tags.append(tag)
+            cover_url='',
+            processing=True,
+            creator=current_user,
+            tags=upsert_tags(parse_tags(form.tags.data)))
 
         db.session.add(game)
         db.session.commit()
 
-        flash('Your game has been created')
+        task = current_user.launch_task('process_game_upload', 'Processing game files...', game.id, manifest,
+                                        on_enqueue_failure=lambda: discard_staged_files(manifest))
+        task.game = game
+        db.session.commit()
+
+        flash('Your game has been created and its files are being processed')
         return redirect(url_for('main.game', id=game.id))
     return render_template('edit_game.html', form=form)
 
@@ -1,3 +1,5 @@
+import json
+import uuid
 import pyotp
 import jwt
 import redis
@@ -6,58 +8,62 @@ from typing import Optional, List
 from datetime import datetime, timezone
 from time import time
 from hashlib import md5
+from threading import Lock
 from slugify import slugify
-from sqlalchemy import Table, Column, Integer, String, ForeignKey
-from sqlalchemy.orm import Mapped, WriteOnlyMapped, mapped_column, relationship, validates
+from sqlalchemy import Table, Column, Index, Integer, String, Text, ForeignKey
+from sqlalchemy.orm import Mapped, WriteOnlyMapped, mapped_column, relationship, validates, make_transient_to_detached
 from flask import current_app
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import db, login
-from app.search import add_to_index, remove_from_index, query_index
+from app.filters import render_markdown
+from app.search import bulk_index
 
 
 class SearchableMixin(object):
     @classmethod
-    def search(cls, expression, page, per_page):
-        ids, total = query_index(cls.__tablename__, expression, page, per_page)
-        if total == 0:
-            return [], 0
-        when = []
-        for i in range(len(ids)):
-            when.append((ids[i], i))
-        query = db.select(cls).where(cls.id.in_(ids)).order_by(
-            db.case(*when, value=cls.id))
-        return db.session.scalars(query), total
+    def after_flush(cls, session, flush_context):
+        changes = session.info.setdefault('search_changes', {})
+        for action, objs in (('index', session.new), ('index', session.dirty), ('delete', session.deleted)):
+            for obj in objs:
+                if isinstance(obj, SearchableMixin):
+                    changes[(obj.__tablename__, obj.id)] = action
 
     @classmethod
     def before_commit(cls, session):
-        session._changes = {
-            'add': list(session.new),
-            'update': list(session.dirty),
-            'delete': list(session.deleted),
-        }
+        session.flush()
+        changes = session.info.pop('search_changes', None)
+        if changes:
+            session.execute(db.insert(SearchOutbox), [
+                {'index_name': index, 'object_id': id, 'action': action}
+                for (index, id), action in changes.items()
+            ])
+            session.info['search_outbox_pending'] = True
 
     @classmethod
     def after_commit(cls, session):
-        for obj in session._changes['add']:
-            if isinstance(obj, SearchableMixin):
-                add_to_index(obj.__tablename__, obj)
-        for obj in session._changes['update']:
-            if isinstance(obj, SearchableMixin):
-                add_to_index(obj.__tablename__, obj)
-        for obj in session._changes['delete']:
-            if isinstance(obj, SearchableMixin):
-                remove_from_index(obj.__tablename__, obj)
-        session._changes = None
+        if session.info.pop('search_outbox_pending', False):
+            try:
+                current_app.task_queue.enqueue('app.tasks.process_search_outbox', retry=rq.Retry(
+                    max=current_app.config['SEARCH_OUTBOX_RETRIES'], interval=[10, 30, 60]))
+            except redis.exceptions.RedisError:
+                current_app.logger.warning('Could not enqueue search outbox job', exc_info=True)
+
+    @classmethod
+    def after_rollback(cls, session):
+        session.info.pop('search_changes', None)
+        session.info.pop('search_outbox_pending', None)
 
     @classmethod
     def reindex(cls):
-        for obj in db.session.scalars(db.select(cls)):
-            add_to_index(cls.__tablename__, obj)
+        query = db.select(cls).execution_options(yield_per=current_app.config['SEARCH_BATCH_SIZE'])
+        return bulk_index(cls.__tablename__, db.session.scalars(query))
 
 
+db.event.listen(db.session, 'after_flush', SearchableMixin.after_flush)
 db.event.listen(db.session, 'before_commit', SearchableMixin.before_commit)
 db.event.listen(db.session, 'after_commit', SearchableMixin.after_commit)
+db.event.listen(db.session, 'after_rollback', SearchableMixin.after_rollback)
 
 
 class User(UserMixin, db.Model):
@@ -95,6 +101,19 @@ class User(UserMixin, db.Model):
             return
         return db.session.get(User, id)
 
+    def get_data_export_token(self, path, expires_in=None):
+        expires_in = expires_in or current_app.config['DATA_EXPORT_LINK_TTL']
+        return jwt.encode({'data_export': path, 'user': self.id, 'exp': time() + expires_in},
+                          current_app.config['SECRET_KEY'], algorithm='HS256')
+
+    @staticmethod
+    def verify_data_export_token(token):
+        try:
+            payload = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
+            return payload['data_export'] if payload['data_export'].startswith(f'exports/{payload["user"]}/') else None
+        except:
+            return
+
     def get_totp_url(self):
         return pyotp.totp.TOTP(self.otp_secret).provisioning_uri(self.username, 'scratch')
 
@@ -106,10 +125,12 @@ class User(UserMixin, db.Model):
         digest = md5(self.email.lower().encode('utf-8')).hexdigest()
         return f'https://www.gravatar.com/avatar/{digest}?d=identicon&s={size}'
 
-    def launch_task(self, name, description, *args, **kwargs):
-        rq_job = current_app.task_queue.enqueue(f'app.tasks.{name}', self.id, *args, **kwargs)
-        task = Task(id=rq_job.get_id(), name=name, description=description, user=self)
+    def launch_task(self, name, description, *args, on_enqueue_failure=None, **kwargs):
+        task = Task(id=str(uuid.uuid4()), name=name, description=description, user=self)
         db.session.add(task)
+        # the job is enqueued once the task row is committed, see _enqueue_pending_jobs
+        db.session.info.setdefault('pending_jobs', []).append(
+            (task.id, f'app.tasks.{name}', (self.id, *args), kwargs, on_enqueue_failure))
         return task
 
     def get_task_in_progress(self, name):
@@ -120,16 +141,98 @@ class User(UserMixin, db.Model):
         return f'<User \'{self.username}\'>'
 
 
+_user_cache_lock = Lock()
+_user_cache_fields = ('id', 'email', 'username', 'website', 'about', 'is_2fa_enabled')
+
+
+def _user_cache_key(id):
+    return f'identity:user:{id}'
+
+
+def _get_cached_user(id):
+    with _user_cache_lock:
+        data = current_app.user_cache.get(id)
+    if data is None:
+        try:
+            value = current_app.redis.get(_user_cache_key(id))
+        except redis.exceptions.RedisError:
+            current_app.logger.warning('User cache unavailable', exc_info=True)
+            return None
+        if value is None:
+            return None
+        data = json.loads(value)
+        with _user_cache_lock:
+            current_app.user_cache[id] = data
+    return data
+
+
+def _set_cached_user(user):
+    data = {field: getattr(user, field) for field in _user_cache_fields}
+    with _user_cache_lock:
+        current_app.user_cache[user.id] = data
+    try:
+        current_app.redis.set(_user_cache_key(user.id), json.dumps(data), ex=current_app.config['USER_CACHE_TTL'])
+    except redis.exceptions.RedisError:
+        current_app.logger.warning('User cache unavailable', exc_info=True)
+
+
+def invalidate_cached_users(ids):
+    with _user_cache_lock:
+        for id in ids:
+            current_app.user_cache.pop(id, None)
+    try:
+        current_app.redis.delete(*[_user_cache_key(id) for id in ids])
+    except redis.exceptions.RedisError:
+        current_app.logger.warning('Could not invalidate user cache', exc_info=True)
+
+
 @login.user_loader
 def load_user(id):
-    return db.session.get(User, int(id))
+    data = _get_cached_user(int(id))
+    if data is None:
+        user = db.session.get(User, int(id))
+        if user:
+            _set_cached_user(user)
+        return user
+    # Password hash and OTP secret are never cached and are loaded on first access
+    user = User.__mapper__.class_manager.new_instance()
+    for field, value in data.items():
+        setattr(user, field, value)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def _user_cache_after_flush(session, flush_context):
+    changed = session.info.setdefault('user_changes', set())
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            changed.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, User) and session.is_modified(obj, include_collections=False):
+            changed.add(obj.id)
+
+
+def _user_cache_after_commit(session):
+    changed = session.info.pop('user_changes', None)
+    if changed:
+        invalidate_cached_users(changed)
+
+
+def _user_cache_after_rollback(session):
+    session.info.pop('user_changes', None)
+
+
+db.event.listen(db.session, 'after_flush', _user_cache_after_flush)
+db.event.listen(db.session, 'after_commit', _user_cache_after_commit)
+db.event.listen(db.session, 'after_rollback', _user_cache_after_rollback)
 
 
 game_tag = Table(
     'game_tag',
     db.metadata,
     Column('game_id', Integer(), ForeignKey('game.id'), primary_key=True),
-    Column('tag_id', Integer(), ForeignKey('tag.id'), primary_key=True)
+    Column('tag_id', Integer(), ForeignKey('tag.id'), primary_key=True),
+    Index('ix_game_tag_tag_id_game_id', 'tag_id', 'game_id')
 )
 
 
@@ -141,10 +244,14 @@ class Game(SearchableMixin, db.Model):
     title: Mapped[str] = mapped_column(String(50))
     tagline: Mapped[Optional[str]] = mapped_column(String(150))
     description: Mapped[Optional[str]] = mapped_column(String(5000))
+    description_html: Mapped[Optional[str]] = mapped_column(Text)
     cover_url: Mapped[str] = mapped_column(String(256))
     created_at: Mapped[datetime] = mapped_column(index=True, default=lambda: datetime.now(timezone.utc))
     updated_at: Mapped[datetime] = mapped_column(default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     user_id: Mapped[int] = mapped_column(ForeignKey(User.id), index=True)
+    processing: Mapped[bool] = mapped_column(default=False)
+    cover_blob_sha256: Mapped[Optional[str]] = mapped_column(ForeignKey('blob.sha256'))
+    cover_variants: Mapped[Optional[dict]] = mapped_column(db.JSON)
 
     creator: Mapped[User] = relationship(back_populates='games')
     uploads: WriteOnlyMapped['Upload'] = relationship(back_populates='game')
@@ -157,10 +264,27 @@ class Game(SearchableMixin, db.Model):
         self.slug = slugify(title)
         return title
 
+    @validates('description')
+    def validate_description(self, key, description):
+        self.description_html = render_markdown(description) if description else None
+        return description
+
     def __repr__(self):
         return f'<Game \'{self.title}\'>'
 
 
+class Blob(db.Model):
+    sha256: Mapped[str] = mapped_column(String(64), primary_key=True)
+    url: Mapped[str] = mapped_column(String(256))
+    size: Mapped[int]
+    content_type: Mapped[Optional[str]] = mapped_column(String(128))
+    refcount: Mapped[int] = mapped_column(default=0)
+    created_at: Mapped[datetime] = mapped_column(default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f'<Blob \'{self.sha256}\'>'
+
+
 class Upload(db.Model):
     id: Mapped[int] = mapped_column(primary_key=True)
     url: Mapped[str] = mapped_column(String(256))
@@ -168,6 +292,7 @@ class Upload(db.Model):
     size: Mapped[int]
     is_web_build: Mapped[bool]
     game_id: Mapped[int] = mapped_column(ForeignKey(Game.id), index=True)
+    blob_sha256: Mapped[Optional[str]] = mapped_column(ForeignKey(Blob.sha256), index=True)
 
     game: Mapped[Game] = relationship(back_populates='uploads')
 
@@ -180,6 +305,8 @@ class Screenshot(db.Model):
     url: Mapped[str] = mapped_column(String(256))
     order: Mapped[int]
     game_id: Mapped[int] = mapped_column(ForeignKey(Game.id), index=True)
+    blob_sha256: Mapped[Optional[str]] = mapped_column(ForeignKey(Blob.sha256), index=True)
+    variants: Mapped[Optional[dict]] = mapped_column(db.JSON)
 
     game: Mapped[Game] = relationship(back_populates='screenshots')
 
@@ -189,16 +316,18 @@ class Screenshot(db.Model):
 
 class Tag(db.Model):
     id: Mapped[int] = mapped_column(primary_key=True)
-    name: Mapped[str] = mapped_column(String(20))
+    name: Mapped[str] = mapped_column(String(20), index=True, unique=True)
 
     games: WriteOnlyMapped[Game] = relationship(secondary=game_tag, back_populates='tags')
 
 
 class Comment(db.Model):
+    __table_args__ = (Index('ix_comment_game_id_created_at_id', 'game_id', 'created_at', 'id'),)
+
     id: Mapped[int] = mapped_column(primary_key=True)
     text: Mapped[str] = mapped_column(String(500))
     created_at: Mapped[datetime] = mapped_column(index=True, default=lambda: datetime.now(timezone.utc))
-    game_id: Mapped[int] = mapped_column(ForeignKey(Game.id), index=True)
+    game_id: Mapped[int] = mapped_column(ForeignKey(Game.id))
     user_id: Mapped[int] = mapped_column(ForeignKey(User.id), index=True)
 
     game: Mapped[Game] = relationship(back_populates='comments')
@@ -211,5 +340,41 @@ class Task(db.Model):
     description: Mapped[Optional[str]] = mapped_column(String(128))
     user_id: Mapped[int] = mapped_column(ForeignKey(User.id))
     complete: Mapped[bool] = mapped_column(default=False)
+    state: Mapped[str] = mapped_column(String(16), default='queued')
+    bytes_done: Mapped[int] = mapped_column(default=0)
+    bytes_total: Mapped[int] = mapped_column(default=0)
+    files_done: Mapped[int] = mapped_column(default=0)
+    game_id: Mapped[Optional[int]] = mapped_column(ForeignKey(Game.id), index=True)
 
     user: Mapped[User] = relationship(back_populates='tasks')
+    game: Mapped[Optional[Game]] = relationship()
+
+
+def _enqueue_pending_jobs(session):
+    for job_id, func, args, kwargs, on_enqueue_failure in session.info.pop('pending_jobs', []):
+        try:
+            current_app.task_queue.enqueue(func, *args, job_id=job_id, **kwargs)
+        except Exception:
+            current_app.logger.error(f'Could not enqueue task {job_id}', exc_info=True)
+            # the session cannot emit SQL after commit, so the task is failed on its own connection
+            with db.engine.begin() as connection:
+                connection.execute(db.update(Task).where(Task.id == job_id).values(state='failed', complete=True))
+            if on_enqueue_failure:
+                on_enqueue_failure()
+
+
+def _discard_pending_jobs(session):
+    session.info.pop('pending_jobs', None)
+
+
+db.event.listen(db.session, 'after_commit', _enqueue_pending_jobs)
+db.event.listen(db.session, 'after_rollback', _discard_pending_jobs)
+
+
+class SearchOutbox(db.Model):
+    id: Mapped[int] = mapped_column(primary_key=True)
+    index_name: Mapped[str] = mapped_column(String(64))
+    object_id: Mapped[int]
+    action: Mapped[str] = mapped_column(String(6))
+    attempts: Mapped[int] = mapped_column(default=0)
+    created_at: Mapped[datetime] = mapped_column(default=lambda: datetime.now(timezone.utc))
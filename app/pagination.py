@@ -0,0 +1,32 @@
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from binascii import Error as DecodeError
+from datetime import datetime
+from app import db
+
+
+def encode_cursor(obj):
+    value = f'{obj.created_at.isoformat()}|{obj.id}'
+    return urlsafe_b64encode(value.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        created_at, id = urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        return datetime.fromisoformat(created_at), int(id)
+    except (DecodeError, UnicodeError, ValueError):
+        return None
+
+
+def keyset_paginate(query, model, cursor, per_page):
+    query = query.order_by(model.created_at.desc(), model.id.desc())
+    position = decode_cursor(cursor)
+    if position:
+        created_at, id = position
+        query = query.where(db.or_(
+            model.created_at < created_at,
+            db.and_(model.created_at == created_at, model.id < id)))
+    items = db.session.scalars(query.limit(per_page + 1)).all()
+    next_cursor = encode_cursor(items[per_page - 1]) if len(items) > per_page else None
+    return items[:per_page], next_cursor
@@ -1,28 +1,217 @@
+import re
+import json
+import sqlite3
+from hashlib import sha1
+from itertools import chain, islice
+from threading import Lock
+from time import perf_counter
 from flask import current_app
+from redis.exceptions import RedisError
+from app.instrumentation import timed
 
-def add_to_index(index, model):
-    if not current_app.elasticsearch:
-        return
+
+class ElasticsearchBackend:
+    def __init__(self, client):
+        self.client = client
+
+    @timed('search')
+    def bulk(self, index, actions):
+        operations = []
+        for id, document in actions:
+            if document is None:
+                operations.append({'delete': {'_index': index, '_id': id}})
+            else:
+                operations.append({'index': {'_index': index, '_id': id}})
+                operations.append(document)
+        response = self.client.bulk(operations=operations)
+        errors = []
+        if response['errors']:
+            for item in response['items']:
+                action, result = next(iter(item.items()))
+                if 'error' in result and not (action == 'delete' and result['status'] == 404):
+                    errors.append({'action': action, 'id': result['_id'], 'error': result['error']})
+        return errors
+
+    @timed('search')
+    def query(self, index, query, page, per_page):
+        search = self.client.search(
+            index=index,
+            query={'multi_match': {'query': query, 'fields': ['*']}},
+            from_=(page - 1) * per_page,
+            size=per_page
+        )
+        ids = [int(hit['_id']) for hit in search['hits']['hits']]
+        return ids, search['hits']['total']['value']
+
+
+class LocalSearchBackend:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.lock = Lock()
+
+    def _table_exists(self, index):
+        return self.connection.execute(
+            'SELECT 1 FROM sqlite_master WHERE type = \'table\' AND name = ?', (index,)).fetchone() is not None
+
+    @timed('search')
+    def bulk(self, index, actions):
+        table = self._quote(index)
+        with self.lock, self.connection:
+            for id, document in actions:
+                if document is None:
+                    if self._table_exists(index):
+                        self.connection.execute(f'DELETE FROM {table} WHERE rowid = ?', (id,))
+                    continue
+                if not self._table_exists(index):
+                    columns = ', '.join(self._quote(field) for field in document)
+                    self.connection.execute(
+                        f'CREATE VIRTUAL TABLE {table} USING fts5({columns}, tokenize=\'porter unicode61\')')
+                fields = ', '.join(self._quote(field) for field in document)
+                placeholders = ', '.join('?' for _ in document)
+                self.connection.execute(f'DELETE FROM {table} WHERE rowid = ?', (id,))
+                self.connection.execute(
+                    f'INSERT INTO {table} (rowid, {fields}) VALUES (?, {placeholders})',
+                    (id, *(value or '' for value in document.values())))
+        return []
+
+    @timed('search')
+    def query(self, index, query, page, per_page):
+        terms = re.findall(r'\w+', query)
+        if not terms:
+            return [], 0
+        table = self._quote(index)
+        expression = ' OR '.join(f'"{term}"' for term in terms)
+        with self.lock:
+            if not self._table_exists(index):
+                return [], 0
+            total = self.connection.execute(
+                f'SELECT count(*) FROM {table} WHERE {table} MATCH ?', (expression,)).fetchone()[0]
+            rows = self.connection.execute(
+                f'SELECT rowid FROM {table} WHERE {table} MATCH ? ORDER BY rank LIMIT ? OFFSET ?',
+                (expression, per_page, (page - 1) * per_page)).fetchall()
+        return [row[0] for row in rows], total
+
+    @staticmethod
+    def _quote(name):
+        if not re.fullmatch(r'\w+', name):
+            raise ValueError(f'Invalid search identifier \'{name}\'')
+        return f'"{name}"'
+
+
+def create_search_backend(app):
+    backend = app.config['SEARCH_BACKEND']
+    if backend == 'elasticsearch':
+        return ElasticsearchBackend(app.elasticsearch) if app.elasticsearch else None
+    if backend == 'local':
+        return LocalSearchBackend(app.config['SEARCH_INDEX_PATH'])
+    return None
+
+
+def _document(model):
     payload = {}
     for field in model.__searchable__:
         payload[field] = getattr(model, field)
-    current_app.elasticsearch.index(index=index, id=model.id, document=payload)
+    return payload
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
 
+def bulk_index(index, add=(), remove=(), backend=None, batch_size=None):
+    backend = backend or current_app.search_backend
+    stats = {'indexed': 0, 'deleted': 0, 'errors': [], 'elapsed': 0.0}
+    if not backend:
+        return stats
+    actions = chain(((model.id, _document(model)) for model in add), ((id, None) for id in remove))
+    for batch in _batches(actions, batch_size or current_app.config['SEARCH_BATCH_SIZE']):
+        start = perf_counter()
+        errors = backend.bulk(index, batch)
+        elapsed = perf_counter() - start
+        indexed = sum(1 for _, document in batch if document is not None)
+        stats['indexed'] += indexed
+        stats['deleted'] += len(batch) - indexed
+        stats['errors'].extend(errors)
+        stats['elapsed'] += elapsed
+        current_app.logger.info(
+            f'Search bulk {index}: {len(batch)} actions in {elapsed:.3f}s '
+            f'({len(batch) / elapsed if elapsed else 0:.0f}/s), {len(errors)} errors')
+        for error in errors:
+            current_app.logger.warning(f'Search bulk {index}: {error}')
+    if stats['indexed'] or stats['deleted']:
+        _bump_query_cache_version(index)
+    return stats
 
-def remove_from_index(index, model):
-    if not current_app.elasticsearch:
+
+def _bump_query_cache_version(index):
+    if not current_app.config['SEARCH_CACHE_TTL']:
         return
-    current_app.elasticsearch.delete(index=index, id=model.id)
+    try:
+        current_app.redis.incr(f'search:{index}:version')
+    except RedisError:
+        current_app.logger.warning(f'Could not invalidate search cache for {index}', exc_info=True)
+
+
+def _query_cache_key(index, query, page, per_page):
+    version = int(current_app.redis.get(f'search:{index}:version') or 0)
+    digest = sha1(' '.join(query.lower().split()).encode('utf-8')).hexdigest()
+    return f'search:{index}:{version}:{digest}:{page}:{per_page}'
+
+
+def query_cache_stats(index):
+    hits, misses = current_app.redis.mget(f'search:{index}:hits', f'search:{index}:misses')
+    return {'hits': int(hits or 0), 'misses': int(misses or 0)}
 
 
 def query_index(index, query, page, per_page):
-    if not current_app.elasticsearch:
+    if not current_app.search_backend:
         return [], 0
-    search = current_app.elasticsearch.search(
-        index=index,
-        query={'multi_match': {'query': query, 'fields': ['*']}},
-        from_=(page - 1) * per_page,
-        size=per_page
-    )
-    ids = [int(hit['_id']) for hit in search['hits']['hits']]
-    return ids, search['hits']['total']['value']
+    ttl = current_app.config['SEARCH_CACHE_TTL']
+    key = None
+    if ttl:
+        try:
+            key = _query_cache_key(index, query, page, per_page)
+            cached = current_app.redis.get(key)
+            current_app.redis.incr(f'search:{index}:hits' if cached else f'search:{index}:misses')
+            if cached:
+                ids, total = json.loads(cached)
+                return ids, total
+        except RedisError:
+            current_app.logger.warning('Search cache unavailable', exc_info=True)
+            key = None
+    ids, total = current_app.search_backend.query(index, query, page, per_page)
+    if key:
+        try:
+            current_app.redis.set(key, json.dumps([ids, total]), ex=ttl)
+        except RedisError:
+            current_app.logger.warning('Search cache unavailable', exc_info=True)
+    return ids, total
+
+
+class MemorySearchClient:
+    def __init__(self):
+        self.indices = {}
+
+    def bulk(self, operations):
+        items = []
+        operations = iter(operations)
+        for operation in operations:
+            action, meta = next(iter(operation.items()))
+            documents = self.indices.setdefault(meta['_index'], {})
+            id = str(meta['_id'])
+            if action == 'index':
+                documents[id] = next(operations)
+                items.append({'index': {'_id': id, 'status': 200}})
+            else:
+                status = 200 if documents.pop(id, None) is not None else 404
+                items.append({'delete': {'_id': id, 'status': status}})
+        return {'errors': False, 'items': items}
+
+    def search(self, index, query, from_, size):
+        terms = query['multi_match']['query'].lower().split()
+        ids = [id for id, document in self.indices.get(index, {}).items()
+               if any(term in str(value).lower() for value in document.values() for term in terms)]
+        return {'hits': {'total': {'value': len(ids)}, 'hits': [{'_id': id} for id in ids[from_:from_ + size]]}}
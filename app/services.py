@@ -0,0 +1,144 @@
+from threading import Lock
+from redis import BlockingConnectionPool, Redis
+from sqlalchemy.pool import QueuePool
+from app.instrumentation import timed
+
+_lock = Lock()
+_waits_lock = Lock()
+_services = {}
+
+
+def _count_wait(pool):
+    with _waits_lock:
+        pool.waits += 1
+
+
+class InstrumentedConnectionPool(BlockingConnectionPool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = 0
+
+    def get_connection(self, *args, **kwargs):
+        if self.pool.empty():
+            _count_wait(self)
+        return super().get_connection(*args, **kwargs)
+
+    def stats(self):
+        created = len(self._connections)
+        idle = sum(1 for connection in list(self.pool.queue) if connection is not None)
+        return {'size': self.max_connections, 'created': created, 'in_use': created - idle, 'waits': self.waits}
+
+
+class InstrumentedRedis(Redis):
+    def execute_command(self, *args, **options):
+        with timed('redis'):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipeline = super().pipeline(transaction, shard_hint)
+        execute = pipeline.execute
+
+        def timed_execute(*args, **kwargs):
+            with timed('redis'):
+                return execute(*args, **kwargs)
+        pipeline.execute = timed_execute
+        return pipeline
+
+
+class InstrumentedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = 0
+
+    def _do_get(self):
+        if self._max_overflow > -1 and self.checkedin() == 0 and self._overflow >= self._max_overflow:
+            _count_wait(self)
+        return super()._do_get()
+
+    def stats(self):
+        return {'size': self.size(), 'created': self.checkedin() + self.checkedout(), 'in_use': self.checkedout(),
+                'overflow': max(self.overflow(), 0), 'waits': self.waits}
+
+
+def _instrument_urllib3_pool(pool):
+    get_conn = pool._get_conn
+    pool.waits = 0
+
+    def instrumented_get_conn(timeout=None):
+        if pool.pool is not None and pool.pool.empty():
+            _count_wait(pool)
+        return get_conn(timeout)
+    pool._get_conn = instrumented_get_conn
+
+
+def shared(key, factory):
+    with _lock:
+        if key not in _services:
+            _services[key] = factory()
+        return _services[key]
+
+
+def _redis_key(config):
+    return 'redis', config['REDIS_URL'], config['REDIS_POOL_SIZE']
+
+
+def redis_pool(config):
+    return shared(_redis_key(config), lambda: InstrumentedConnectionPool.from_url(
+        config['REDIS_URL'], max_connections=config['REDIS_POOL_SIZE'], timeout=config['REDIS_POOL_TIMEOUT']))
+
+
+def redis_client(config):
+    return InstrumentedRedis(connection_pool=redis_pool(config))
+
+
+def _elasticsearch_key(config):
+    return 'elasticsearch', config['ELASTICSEARCH_URL'], config['ELASTICSEARCH_POOL_SIZE']
+
+
+def elasticsearch_client(config):
+    def factory():
+        from elasticsearch import Elasticsearch
+        client = Elasticsearch(config['ELASTICSEARCH_URL'], connections_per_node=config['ELASTICSEARCH_POOL_SIZE'],
+                               request_timeout=config['ELASTICSEARCH_TIMEOUT'])
+        for node in client.transport.node_pool.all():
+            _instrument_urllib3_pool(node.pool)
+        return client
+    return shared(_elasticsearch_key(config), factory)
+
+
+def firebase_app(config):
+    def factory():
+        import firebase_admin
+        from firebase_admin import credentials
+        try:
+            return firebase_admin.get_app()
+        except ValueError:
+            cred = credentials.Certificate(config['GOOGLE_APPLICATION_CREDENTIALS'])
+            return firebase_admin.initialize_app(cred, {
+                'storageBucket': config['FIREBASE_STORAGE_BUCKET']
+            })
+    return shared(('firebase',), factory)
+
+
+def pool_stats(app, engine):
+    stats = {}
+    with _lock:
+        redis = _services.get(_redis_key(app.config))
+        elasticsearch = _services.get(_elasticsearch_key(app.config))
+    if redis is not None:
+        stats['redis'] = redis.stats()
+    if elasticsearch is not None:
+        pools = [node.pool for node in elasticsearch.transport.node_pool.all()]
+        stats['elasticsearch'] = {
+            'size': sum(pool.pool.maxsize for pool in pools),
+            'created': sum(pool.num_connections for pool in pools),
+            'in_use': sum(pool.pool.maxsize - pool.pool.qsize() for pool in pools),
+            'waits': sum(getattr(pool, 'waits', 0) for pool in pools)
+        }
+    if isinstance(engine.pool, InstrumentedQueuePool):
+        stats['database'] = engine.pool.stats()
+    elif isinstance(engine.pool, QueuePool):
+        pool = engine.pool
+        stats['database'] = {'size': pool.size(), 'created': pool.checkedin() + pool.checkedout(),
+                             'in_use': pool.checkedout(), 'overflow': max(pool.overflow(), 0)}
+    return stats
@@ -0,0 +1,86 @@
+import secrets
+from flask import session as current_session
+from flask.sessions import SecureCookieSession, SecureCookieSessionInterface, session_json_serializer
+from itsdangerous import BadSignature
+from redis.exceptions import RedisError
+
+
+class RedisSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None):
+        super().__init__(initial)
+        self.sid = sid or secrets.token_urlsafe(32)
+
+
+class RedisSessionInterface(SecureCookieSessionInterface):
+    session_class = RedisSession
+    prefix = 'session:'
+
+    def _lifetime(self, app):
+        return int(app.permanent_session_lifetime.total_seconds())
+
+    def regenerate(self, app, **extra):
+        session = current_session._get_current_object()
+        if not isinstance(session, RedisSession):
+            return
+        old_sid = session.sid
+        session.sid = secrets.token_urlsafe(32)
+        session.modified = True
+        try:
+            app.redis.delete(self.prefix + old_sid)
+        except RedisError:
+            app.logger.warning('Session store unavailable', exc_info=True)
+
+    def open_session(self, app, request):
+        serializer = self.get_signing_serializer(app)
+        if serializer is None:
+            return None
+        value = request.cookies.get(self.get_cookie_name(app))
+        if not value:
+            return self.session_class()
+        try:
+            sid = serializer.loads(value, max_age=self._lifetime(app))
+            data = app.redis.get(self.prefix + sid)
+        except BadSignature:
+            return self.session_class()
+        except RedisError:
+            app.logger.warning('Session store unavailable', exc_info=True)
+            return self.session_class()
+        if data is None:
+            return self.session_class()
+        return self.session_class(session_json_serializer.loads(data.decode('utf-8')), sid=sid)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified:
+                try:
+                    app.redis.delete(self.prefix + session.sid)
+                except RedisError:
+                    app.logger.warning('Session store unavailable', exc_info=True)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure, samesite=samesite,
+                                       httponly=httponly)
+                response.vary.add('Cookie')
+            return
+
+        if not self.should_set_cookie(app, session):
+            return
+
+        try:
+            app.redis.set(self.prefix + session.sid, session_json_serializer.dumps(dict(session)),
+                          ex=self._lifetime(app))
+        except RedisError:
+            app.logger.warning('Could not save session', exc_info=True)
+            return
+        response.set_cookie(name, self.get_signing_serializer(app).dumps(session.sid),
+                            expires=self.get_expiration_time(app, session), httponly=httponly, domain=domain,
+                            path=path, secure=secure, samesite=samesite)
+        response.vary.add('Cookie')
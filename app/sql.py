@@ -0,0 +1,13 @@
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from app import db
+
+
+def insert_ignore(table):
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing()
+    if dialect in ('mysql', 'mariadb'):
+        return mysql.insert(table).prefix_with('IGNORE')
+    return None
@@ -59,4 +59,101 @@ document.addEventListener('DOMContentLoaded', () => {
         iframePlaceholder.removeAttribute('data-iframe')
         iframePlaceholder.innerHTML = iframe
     })
+
+
+    const gameProgress = document.getElementById('game-progress')
+    const progressBar = gameProgress?.querySelector('.progress-bar')
+
+    const pollGameProgress = async () => {
+        const response = await fetch(gameProgress.getAttribute('data-progress-url'))
+        if (!response.ok) {
+            return
+        }
+        const progress = await response.json()
+        if (!progress.processing) {
+            window.location.reload()
+        } else if (progress.state !== 'failed') {
+            if (progress.bytes_total) {
+                progressBar.style.width = `${Math.round(100 * progress.bytes_done / progress.bytes_total)}%`
+            }
+            setTimeout(pollGameProgress, 2000)
+        }
+    }
+
+    if (progressBar) {
+        setTimeout(pollGameProgress, 2000)
+    }
+
+
+    const gameFeed = document.getElementById('game-feed')
+    const gameFeedMore = document.getElementById('game-feed-more')
+    let loadingFeed = false
+
+    const loadMoreGames = async () => {
+        const nextUrl = gameFeedMore.getAttribute('data-next-url')
+        if (loadingFeed || !nextUrl) {
+            return
+        }
+        loadingFeed = true
+        const response = await fetch(nextUrl)
+        if (response.ok) {
+            const page = await response.json()
+            gameFeed.insertAdjacentHTML('beforeend', page.html)
+            if (page.next_url) {
+                gameFeedMore.setAttribute('data-next-url', page.next_url)
+            } else {
+                gameFeedMore.remove()
+                feedObserver.disconnect()
+            }
+        }
+        loadingFeed = false
+    }
+
+    const feedObserver = new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) {
+            loadMoreGames()
+        }
+    }, { rootMargin: '400px' })
+
+    if (gameFeed && gameFeedMore) {
+        gameFeedMore.querySelector('a').addEventListener('click', event => {
+            event.preventDefault()
+            loadMoreGames()
+        })
+        feedObserver.observe(gameFeedMore)
+    }
+
+
+    const commentList = document.getElementById('comment-list')
+    const commentListMore = document.getElementById('comment-list-more')
+    let loadingComments = false
+
+    const loadMoreComments = async () => {
+        const nextUrl = commentListMore.getAttribute('data-next-url')
+        if (loadingComments || !nextUrl) {
+            return
+        }
+        loadingComments = true
+        const response = await fetch(nextUrl)
+        if (response.ok) {
+            const page = await response.json()
+            commentList.insertAdjacentHTML('beforeend', page.html)
+            if (typeof flask_moment_render_all === 'function') {
+                flask_moment_render_all()
+            }
+            if (page.next_url) {
+                commentListMore.setAttribute('data-next-url', page.next_url)
+            } else {
+                commentListMore.remove()
+            }
+        }
+        loadingComments = false
+    }
+
+    if (commentList && commentListMore) {
+        commentListMore.querySelector('a').addEventListener('click', event => {
+            event.preventDefault()
+            loadMoreComments()
+        })
+    }
 })
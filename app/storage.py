@@ -0,0 +1,185 @@
+import os
+import mmap
+import shutil
+import tempfile
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from hashlib import sha256
+from urllib.parse import urlsplit
+from time import perf_counter, sleep
+from flask import current_app, send_from_directory
+from app.instrumentation import timed
+
+
+class HashingReader:
+    def __init__(self, stream):
+        self.stream = stream
+        self.size = 0
+        self.digest = sha256()
+
+    def read(self, size=-1):
+        position = self.stream.tell()
+        chunk = self.stream.read(size)
+        if position <= self.size < position + len(chunk):
+            self.digest.update(chunk[self.size - position:])
+            self.size = position + len(chunk)
+        return chunk
+
+    def tell(self):
+        return self.stream.tell()
+
+    def seek(self, offset, whence=0):
+        return self.stream.seek(offset, whence)
+
+    @property
+    def checksum(self):
+        return self.digest.hexdigest()
+
+
+class FirebaseStorage:
+    def __init__(self, chunk_size):
+        granularity = 256 * 1024
+        self.chunk_size = max(granularity, (chunk_size + granularity - 1) // granularity * granularity)
+
+    same_origin = False
+
+    @property
+    def bucket(self):
+        from firebase_admin import storage as firebase_storage
+        return firebase_storage.bucket()
+
+    @timed('storage')
+    def put(self, path, stream, content_type=None, size=None):
+        if size is not None and size <= self.chunk_size:
+            blob = self.bucket.blob(path)
+        else:
+            blob = self.bucket.blob(path, chunk_size=self.chunk_size)
+        reader = HashingReader(stream)
+        blob.upload_from_file(reader, content_type=content_type, size=size)
+        return reader.size, reader.checksum
+
+    @timed('storage')
+    def stream(self, path):
+        return self.bucket.blob(path).open('rb')
+
+    @timed('storage')
+    def get_range(self, path, start, end):
+        return self.bucket.blob(path).download_as_bytes(start=start, end=end)
+
+    @timed('storage')
+    def exists(self, path):
+        return self.bucket.blob(path).exists()
+
+    @timed('storage')
+    def delete(self, path):
+        self.bucket.blob(path).delete()
+
+    def public_url(self, path):
+        return self.bucket.blob(path).public_url
+
+
+class LocalStorage:
+    def __init__(self, root, base_url, chunk_size):
+        self.root = os.path.realpath(root)
+        self.base_url = base_url.rstrip('/')
+        self.chunk_size = chunk_size
+        self.same_origin = not urlsplit(self.base_url).netloc
+
+    def _path(self, path):
+        full_path = os.path.realpath(os.path.join(self.root, path))
+        if os.path.commonpath([full_path, self.root]) != self.root:
+            raise ValueError(f'Invalid storage path \'{path}\'')
+        return full_path
+
+    @timed('storage')
+    def put(self, path, stream, content_type=None, size=None):
+        full_path = self._path(path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        reader = HashingReader(stream)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(full_path), delete=False) as tmp_file:
+            try:
+                shutil.copyfileobj(reader, tmp_file, self.chunk_size)
+            except BaseException:
+                os.unlink(tmp_file.name)
+                raise
+        os.replace(tmp_file.name, full_path)
+        return reader.size, reader.checksum
+
+    @timed('storage')
+    def stream(self, path):
+        return open(self._path(path), 'rb')
+
+    @timed('storage')
+    def get_range(self, path, start, end):
+        with open(self._path(path), 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return b''
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[start:end + 1]
+
+    @timed('storage')
+    def exists(self, path):
+        return os.path.isfile(self._path(path))
+
+    @timed('storage')
+    def delete(self, path):
+        os.unlink(self._path(path))
+
+    def public_url(self, path):
+        return f'{self.base_url}/{path}'
+
+    @timed('storage')
+    def send(self, path):
+        web_build = '/uploads/web/' in path
+        response = send_from_directory(self.root, path, conditional=True, as_attachment=not web_build)
+        response.headers['X-Content-Type-Options'] = 'nosniff'
+        if self.same_origin:
+            response.headers['Content-Security-Policy'] = 'sandbox allow-scripts allow-pointer-lock'
+            if web_build:
+                response.headers['Access-Control-Allow-Origin'] = '*'
+        return response
+
+
+def create_storage(app):
+    if app.config['STORAGE_BACKEND'] == 'local':
+        return LocalStorage(app.config['LOCAL_STORAGE_PATH'], app.config['LOCAL_STORAGE_URL'],
+                            app.config['UPLOAD_CHUNK_SIZE'])
+    return FirebaseStorage(app.config['UPLOAD_CHUNK_SIZE'])
+
+
+def _upload_file(storage, path, opener, size, retries):
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    for attempt in range(retries + 1):
+        try:
+            with opener() as stream:
+                size, checksum = storage.put(path, stream, content_type, size)
+            return {'path': path, 'url': storage.public_url(path), 'size': size, 'checksum': checksum}
+        except Exception:
+            if attempt == retries:
+                raise
+            sleep(0.5 * 2 ** attempt)
+
+
+def upload_files(storage, files, max_workers=None, retries=None, progress=None):
+    app = current_app._get_current_object()
+    max_workers = max_workers or app.config['UPLOAD_WORKERS']
+    retries = app.config['UPLOAD_RETRIES'] if retries is None else retries
+    start = perf_counter()
+    manifest = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_upload_file, storage, path, opener, size, retries)
+                   for path, opener, size in files]
+        try:
+            for future in as_completed(futures):
+                entry = future.result()
+                manifest.append(entry)
+                if progress:
+                    progress(entry['size'])
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+    manifest.sort(key=lambda entry: entry['path'])
+    result = {'files': manifest, 'bytes': sum(entry['size'] for entry in manifest), 'elapsed': perf_counter() - start}
+    app.logger.info(f'Uploaded {len(manifest)} files ({result["bytes"]} bytes) in {result["elapsed"]:.2f}s')
+    return result
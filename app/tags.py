@@ -0,0 +1,47 @@
+from flask import current_app
+from sqlalchemy import func
+from redis.exceptions import RedisError
+from app import db
+from app.sql import insert_ignore
+from app.cache import cache_get, cache_set, cache_key
+from app.models import Game, Tag, game_tag
+
+
+def parse_tags(tags_str):
+    return sorted({tag.strip() for tag in (tags_str or '').lower().split(',') if tag.strip()})
+
+
+def upsert_tags(names):
+    if not names:
+        return []
+    insert = insert_ignore(Tag.__table__)
+    if insert is not None:
+        db.session.execute(insert, [{'name': name} for name in names])
+    else:
+        existing = set(db.session.scalars(db.select(Tag.name).where(Tag.name.in_(names))))
+        db.session.add_all([Tag(name=name) for name in names if name not in existing])
+        db.session.flush()
+    return db.session.scalars(db.select(Tag).where(Tag.name.in_(names)).order_by(Tag.name)).all()
+
+
+def tag_games_query(name):
+    return db.select(Game).join(game_tag, game_tag.c.game_id == Game.id).join(Tag, Tag.id == game_tag.c.tag_id) \
+        .where(Tag.name == name, Game.processing == False)
+
+
+def tag_count(name):
+    try:
+        key = cache_key(f'tag-count:{name}', ['games'])
+        count = cache_get(key)
+    except RedisError:
+        current_app.logger.warning('Tag count cache unavailable', exc_info=True)
+        key, count = None, None
+    if count is not None:
+        return int(count)
+    count = db.session.scalar(tag_games_query(name).with_only_columns(func.count(Game.id)).order_by(None))
+    if key:
+        try:
+            cache_set(key, str(count), current_app.config['FRAGMENT_CACHE_TTL'])
+        except RedisError:
+            current_app.logger.warning('Tag count cache unavailable', exc_info=True)
+    return count
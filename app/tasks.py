@@ -1,59 +1,207 @@
+import os
 import sys
+import gzip
 import json
+import tempfile
+from datetime import timedelta
+from time import monotonic
 from rq import get_current_job
 from flask import render_template
-from app import create_app, db
-from app.models import User, Comment, Task
+from app import create_worker_app, db
+from app.models import User, Game, Comment, Task, SearchableMixin, SearchOutbox
 from app.email import send_email
+from app.search import bulk_index
+from app.uploads import process_game_files, discard_staged_files
 
-app = create_app()
+app = create_worker_app()
 app.app_context().push()
 
 def _set_task_completed():
     job = get_current_job()
     if job:
         task = db.session.get(Task, job.get_id())
+        if task is None:
+            app.logger.warning(f'Task {job.get_id()} not found')
+            return
         task.complete = True
         db.session.commit()
 
 
-def export_data(user_id):
+def _set_task_progress(**progress):
+    job = get_current_job()
+    if job:
+        task = db.session.get(Task, job.get_id())
+        if task is None:
+            app.logger.warning(f'Task {job.get_id()} not found')
+            return
+        for key, value in progress.items():
+            setattr(task, key, value)
+        db.session.commit()
+
+
+def _progress_reporter(interval=1.0):
+    done = {'bytes': 0, 'files': 0, 'reported_at': monotonic()}
+
+    def report(size):
+        done['bytes'] += size
+        done['files'] += 1
+        if monotonic() - done['reported_at'] >= interval:
+            _set_task_progress(bytes_done=done['bytes'], files_done=done['files'])
+            done['reported_at'] = monotonic()
+
+    report.done = done
+    return report
+
+
+def process_game_upload(user_id, game_id, manifest):
+    try:
+        _set_task_progress(state='running', bytes_total=manifest['size'])
+        game = db.session.get(Game, game_id)
+        progress = _progress_reporter()
+        rows = process_game_files(game, manifest, app.storage, progress)
+        db.session.add_all(rows)
+        game.processing = False
+        db.session.commit()
+        _set_task_progress(state='finished', bytes_done=progress.done['bytes'], files_done=progress.done['files'])
+    except Exception:
+        db.session.rollback()
+        app.logger.error('Unhandled exception', exc_info=sys.exc_info())
+        _set_task_progress(state='failed')
+    finally:
+        discard_staged_files(manifest)
+        _set_task_completed()
+
+
+def _export_rows(query, id_column):
+    last_id = None
+    while True:
+        batch_query = query.order_by(id_column).limit(app.config['DATA_EXPORT_BATCH_SIZE'])
+        if last_id is not None:
+            batch_query = batch_query.where(id_column > last_id)
+        rows = db.session.execute(batch_query).all()
+        if not rows:
+            break
+        yield from rows
+        last_id = rows[-1].id
+
+
+def _write_data_export(user, file, progress):
+    def write(record):
+        line = (json.dumps(record, default=str) + '\n').encode('utf-8')
+        file.write(line)
+        progress(len(line))
+
+    write({
+        'type': 'user',
+        'username': user.username,
+        'email': user.email,
+        'website': user.website,
+        'about': user.about,
+        '2fa_enabled': user.is_2fa_enabled
+    })
+    games = db.select(Game.id, Game.title, Game.tagline, Game.description, Game.created_at, Game.updated_at) \
+        .where(Game.user_id == user.id)
+    for game in _export_rows(games, Game.id):
+        write({'type': 'game', **game._asdict()})
+    comments = db.select(Comment.id, Comment.game_id, Comment.text, Comment.created_at) \
+        .where(Comment.user_id == user.id)
+    for comment in _export_rows(comments, Comment.id):
+        write({'type': 'comment', **comment._asdict()})
+
+
+def delete_data_export(path):
+    if app.storage.exists(path):
+        app.storage.delete(path)
+
+
+def export_data(user_id, path, download_url):
+    uploaded = False
     try:
+        _set_task_progress(state='running')
         user = db.session.get(User, user_id)
+        progress = _progress_reporter()
 
-        data = {
-            'username': user.username,
-            'email': user.email,
-            'website': user.website,
-            'about': user.about,
-            '2fa_enabled': user.is_2fa_enabled,
-            'games': [],
-            'comments': []
-        }
-
-        for game in db.session.scalars(user.games.select()):
-            data['games'].append({
-                'title': game.title,
-                'tagline': game.tagline,
-                'description': game.description,
-                'created_at': game.created_at,
-                'updated_at': game.updated_at,
-            })
-        for comment in db.session.scalars(db.select(Comment).where(Comment.author == user)):
-            data['comments'].append({
-                'text': comment.text
-            })
+        os.makedirs(app.config['UPLOAD_STAGING_DIR'], exist_ok=True)
+        with tempfile.TemporaryFile(dir=app.config['UPLOAD_STAGING_DIR']) as tmp_file:
+            with gzip.GzipFile(fileobj=tmp_file, mode='wb') as gzip_file:
+                _write_data_export(user, gzip_file, progress)
+            size = tmp_file.tell()
+            tmp_file.seek(0)
+            app.storage.put(path, tmp_file, 'application/gzip', size)
+            uploaded = True
+        app.task_queue.enqueue_in(timedelta(seconds=app.config['DATA_EXPORT_LINK_TTL']),
+                                  'app.tasks.delete_data_export', path)
 
         send_email(
             '[scratch] Your Data Export',
             app.config['ADMINS'][0],
             [user.email],
-            render_template('email/export_data.txt', user=user),
-            render_template('email/export_data.html', user=user),
-            [('data.json', json.dumps(data, indent=4, default=str), 'application/json')],
+            render_template('email/export_data.txt', user=user, download_url=download_url),
+            render_template('email/export_data.html', user=user, download_url=download_url),
+            None,
             True
         )
+        _set_task_progress(state='finished', bytes_done=progress.done['bytes'], files_done=progress.done['files'])
     except Exception:
+        db.session.rollback()
         app.logger.error('Unhandled exception', exc_info=sys.exc_info())
+        _set_task_progress(state='failed')
+        if uploaded:
+            delete_data_export(path)
     finally:
         _set_task_completed()
+
+
+def _drain_search_outbox_batch(rows):
+    models = {cls.__tablename__: cls for cls in SearchableMixin.__subclasses__()}
+    latest = {}
+    for row in rows:
+        latest[(row.index_name, row.object_id)] = row.action
+    failed = set()
+    for index, cls in models.items():
+        index_ids = {id for (name, id), action in latest.items() if name == index and action == 'index'}
+        delete_ids = {id for (name, id), action in latest.items() if name == index and action == 'delete'}
+        if not index_ids and not delete_ids:
+            continue
+        objs = db.session.scalars(db.select(cls).where(cls.id.in_(index_ids))).all() if index_ids else []
+        delete_ids |= index_ids - {obj.id for obj in objs}
+        stats = bulk_index(index, objs, delete_ids)
+        failed |= {(index, int(error['id'])) for error in stats['errors']}
+    return failed
+
+
+def process_search_outbox():
+    max_attempts = app.config['SEARCH_OUTBOX_MAX_ATTEMPTS']
+    last_id = 0
+    retrying = 0
+    while True:
+        rows = db.session.scalars(db.select(SearchOutbox).where(SearchOutbox.id > last_id).order_by(
+            SearchOutbox.id).limit(app.config['SEARCH_BATCH_SIZE'])).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        try:
+            failed = _drain_search_outbox_batch(rows)
+        except Exception:
+            db.session.rollback()
+            db.session.execute(db.update(SearchOutbox).where(SearchOutbox.id.in_([row.id for row in rows])).values(
+                attempts=SearchOutbox.attempts + 1))
+            db.session.commit()
+            raise
+        retry = []
+        for row in rows:
+            if (row.index_name, row.object_id) not in failed:
+                continue
+            if row.attempts + 1 >= max_attempts:
+                app.logger.error(f'Dropping search outbox entry {row.index_name}/{row.object_id} after {max_attempts} attempts')
+            else:
+                retry.append(row.id)
+        db.session.execute(db.delete(SearchOutbox).where(
+            SearchOutbox.id.in_([row.id for row in rows if row.id not in retry])))
+        if retry:
+            db.session.execute(db.update(SearchOutbox).where(SearchOutbox.id.in_(retry)).values(
+                attempts=SearchOutbox.attempts + 1))
+        db.session.commit()
+        retrying += len(retry)
+    if retrying:
+        raise RuntimeError(f'{retrying} search outbox entries failed to index')
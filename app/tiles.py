@@ -0,0 +1,70 @@
+from collections import namedtuple
+from threading import Lock
+from flask import current_app
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import Game
+from app.search import query_index
+
+GameTile = namedtuple('GameTile', ['id', 'slug', 'title', 'tagline', 'cover_url', 'cover_variants', 'tags',
+                                   'updated_at'])
+TagTile = namedtuple('TagTile', ['name'])
+
+_lock = Lock()
+
+
+def game_tile(game):
+    return GameTile(game.id, game.slug, game.title, game.tagline, game.cover_url, game.cover_variants,
+                    tuple(TagTile(tag.name) for tag in game.tags), game.updated_at)
+
+
+def hydrate_tiles(ids):
+    cache = current_app.tile_cache
+    with _lock:
+        tiles = {id: cache.get(id) for id in ids}
+    missing = [id for id, tile in tiles.items() if tile is None]
+    if missing:
+        query = db.select(Game).where(Game.id.in_(missing), Game.processing == False).options(joinedload(Game.tags))
+        for game in db.session.scalars(query).unique():
+            tiles[game.id] = game_tile(game)
+        with _lock:
+            for id in missing:
+                if tiles[id] is not None:
+                    cache[id] = tiles[id]
+    return [tiles[id] for id in ids if tiles[id] is not None]
+
+
+def search_tiles(expression, page, per_page):
+    ids, total = query_index(Game.__tablename__, expression, page, per_page)
+    if total == 0:
+        return [], 0
+    return hydrate_tiles(ids), total
+
+
+def invalidate_tiles(ids):
+    cache = current_app.tile_cache
+    with _lock:
+        for id in ids:
+            cache.pop(id, None)
+
+
+def _after_flush(session, flush_context):
+    changed = session.info.setdefault('tile_changes', set())
+    for obj in (*session.dirty, *session.deleted):
+        if isinstance(obj, Game):
+            changed.add(obj.id)
+
+
+def _after_commit(session):
+    changed = session.info.pop('tile_changes', None)
+    if changed:
+        invalidate_tiles(changed)
+
+
+def _after_rollback(session):
+    session.info.pop('tile_changes', None)
+
+
+db.event.listen(db.session, 'after_flush', _after_flush)
+db.event.listen(db.session, 'after_commit', _after_commit)
+db.event.listen(db.session, 'after_rollback', _after_rollback)
@@ -0,0 +1,144 @@
+import os
+import shutil
+import zipfile
+from functools import partial
+from hashlib import sha256
+from flask import current_app
+from werkzeug.utils import secure_filename
+from app import db
+from app.sql import insert_ignore
+from app.models import Upload, Screenshot, Blob
+from app.images import image_variants, check_image
+from app.storage import upload_files
+
+
+class WebBuildError(Exception):
+    pass
+
+
+def check_web_build(zip_file):
+    config = current_app.config
+    members = [member for member in zip_file.infolist() if not member.is_dir()]
+    if len(members) > config['WEB_BUILD_MAX_FILES']:
+        raise WebBuildError(f'Web builds may contain at most {config["WEB_BUILD_MAX_FILES"]} files')
+    for member in members:
+        if member.filename.startswith('/') or '..' in member.filename.split('/') or '\\' in member.filename:
+            raise WebBuildError(f'Invalid file name \'{member.filename}\' in web build')
+    total_size = sum(member.file_size for member in members)
+    if total_size > config['WEB_BUILD_MAX_SIZE']:
+        raise WebBuildError(f'Web builds may be at most {config["WEB_BUILD_MAX_SIZE"] // (1024 * 1024)} MB uncompressed')
+    if total_size > config['WEB_BUILD_MAX_RATIO'] * max(sum(member.compress_size for member in members), 1):
+        raise WebBuildError('Web build is compressed too heavily')
+    return members
+
+
+def _stage_file(staging_dir, file, name):
+    path = os.path.join(staging_dir, name)
+    file.save(path)
+    return {
+        'path': path,
+        'filename': secure_filename(file.filename),
+        'extension': os.path.splitext(file.filename)[1],
+        'mimetype': file.mimetype,
+        'size': os.path.getsize(path)
+    }
+
+
+def stage_game_files(folder, uploads, uploads_metadata, cover_file, screenshot_files):
+    staging_dir = os.path.join(current_app.config['UPLOAD_STAGING_DIR'], folder)
+    os.makedirs(staging_dir)
+    manifest = {'folder': folder, 'staging_dir': staging_dir, 'uploads': [], 'cover': None, 'screenshots': []}
+
+    try:
+        for index, upload_file in enumerate(uploads or []):
+            staged = _stage_file(staging_dir, upload_file, f'upload-{index}')
+            staged['is_web_build'] = uploads_metadata[index].get('is_web_build', False)
+            if staged['is_web_build']:
+                with zipfile.ZipFile(staged['path']) as zip_file:
+                    staged['size'] = sum(member.file_size for member in check_web_build(zip_file))
+            manifest['uploads'].append(staged)
+
+        if cover_file:
+            manifest['cover'] = _stage_file(staging_dir, cover_file, 'cover')
+            check_image(manifest['cover']['path'], 'Cover image')
+
+        for index, screenshot_file in enumerate(screenshot_files or []):
+            staged = _stage_file(staging_dir, screenshot_file, f'screenshot-{index}')
+            check_image(staged['path'], f'Screenshot \'{staged["filename"]}\'')
+            manifest['screenshots'].append(staged)
+    except Exception:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+    staged_files = [*manifest['uploads'], manifest['cover'], *manifest['screenshots']]
+    manifest['size'] = sum(staged['size'] for staged in staged_files if staged)
+    return manifest
+
+
+def discard_staged_files(manifest):
+    shutil.rmtree(manifest['staging_dir'], ignore_errors=True)
+
+
+def _file_checksum(path):
+    digest = sha256()
+    with open(path, 'rb') as stream:
+        for chunk in iter(partial(stream.read, 1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _store_blob(storage, staged, progress):
+    checksum = _file_checksum(staged['path'])
+    blob = db.session.get(Blob, checksum, with_for_update=True)
+    if blob is None:
+        path = f'blobs/{checksum[:2]}/{checksum}{staged["extension"].lower()}'
+        with open(staged['path'], 'rb') as stream:
+            size, _ = storage.put(path, stream, staged['mimetype'], staged['size'])
+        values = {'sha256': checksum, 'url': storage.public_url(path), 'size': size, 'content_type': staged['mimetype']}
+        # a concurrent job may store the same blob, insert-ignore avoids a savepoint rollback in this session
+        insert = insert_ignore(Blob.__table__)
+        if insert is not None:
+            db.session.execute(insert, [values])
+            blob = db.session.get(Blob, checksum, with_for_update=True)
+        else:
+            blob = Blob(**values)
+            db.session.add(blob)
+    blob.refcount += 1
+    if progress:
+        progress(staged['size'])
+    return blob
+
+
+def process_game_files(game, manifest, storage, progress=None):
+    folder = manifest['folder']
+    rows = []
+
+    for staged in manifest['uploads']:
+        if staged['is_web_build']:
+            with zipfile.ZipFile(staged['path']) as zip_file:
+                members = check_web_build(zip_file)
+                files = [(f'{folder}/uploads/web/{member.filename}', partial(zip_file.open, member), member.file_size)
+                         for member in members]
+                result = upload_files(storage, files, progress=progress)
+
+            for entry in result['files']:
+                if entry['path'] == f'{folder}/uploads/web/index.html':
+                    rows.append(Upload(url=entry['url'], filename='index.html', game_id=game.id, is_web_build=True,
+                                       size=result['bytes']))
+        else:
+            blob = _store_blob(storage, staged, progress)
+            rows.append(Upload(url=blob.url, filename=staged['filename'], game_id=game.id, is_web_build=False,
+                               size=blob.size, blob_sha256=blob.sha256))
+
+    if manifest['cover']:
+        blob = _store_blob(storage, manifest['cover'], progress)
+        game.cover_url = blob.url
+        game.cover_blob_sha256 = blob.sha256
+        game.cover_variants = image_variants(storage, manifest['cover']['path'], blob.sha256)
+
+    for index, staged in enumerate(manifest['screenshots']):
+        blob = _store_blob(storage, staged, progress)
+        rows.append(Screenshot(url=blob.url, order=index, game_id=game.id, blob_sha256=blob.sha256,
+                               variants=image_variants(storage, staged['path'], blob.sha256)))
+
+    return rows
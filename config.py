@@ -13,6 +13,59 @@ class Config:
     ELASTICSEARCH_URL = os.environ.get('ELASTICSEARCH_URL')
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
+    MAIL_QUEUE_SIZE = int(os.environ.get('MAIL_QUEUE_SIZE') or 1000)
+    MAIL_QUEUE_TIMEOUT = float(os.environ.get('MAIL_QUEUE_TIMEOUT') or 1)
+    MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE') or 50)
+    MAIL_RETRIES = int(os.environ.get('MAIL_RETRIES') or 3)
+    MAIL_RETRY_BACKOFF = float(os.environ.get('MAIL_RETRY_BACKOFF') or 1)
+    MAIL_IDLE_TIMEOUT = float(os.environ.get('MAIL_IDLE_TIMEOUT') or 30)
+    MAIL_SHUTDOWN_TIMEOUT = float(os.environ.get('MAIL_SHUTDOWN_TIMEOUT') or 10)
     ADMINS = ['admin@scratch.io']
     REDIS_URL = os.environ.get('REDIS_URL') or 'redis://'
-    RESULTS_PER_PAGE = 25
\ No newline at end of file
+    REDIS_POOL_SIZE = int(os.environ.get('REDIS_POOL_SIZE') or 50)
+    REDIS_POOL_TIMEOUT = int(os.environ.get('REDIS_POOL_TIMEOUT') or 5)
+    ELASTICSEARCH_POOL_SIZE = int(os.environ.get('ELASTICSEARCH_POOL_SIZE') or 10)
+    ELASTICSEARCH_TIMEOUT = int(os.environ.get('ELASTICSEARCH_TIMEOUT') or 10)
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ['DATABASE_POOL_SIZE']),
+        'max_overflow': int(os.environ.get('DATABASE_MAX_OVERFLOW') or 10),
+        'pool_pre_ping': True
+    } if os.environ.get('DATABASE_POOL_SIZE') else {}
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE') or 0)
+    PROFILE_DIR = os.environ.get('PROFILE_DIR') or os.path.join(basedir, 'profiles')
+    PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP') or 20)
+    RESULTS_PER_PAGE = 25
+    GAMES_PER_PAGE = 24
+    COMMENTS_PER_PAGE = 20
+    SEARCH_BATCH_SIZE = int(os.environ.get('SEARCH_BATCH_SIZE') or 500)
+    SEARCH_OUTBOX_RETRIES = int(os.environ.get('SEARCH_OUTBOX_RETRIES') or 3)
+    SEARCH_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('SEARCH_OUTBOX_MAX_ATTEMPTS') or 10)
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND') or ('elasticsearch' if ELASTICSEARCH_URL else 'local')
+    SEARCH_INDEX_PATH = os.environ.get('SEARCH_INDEX_PATH') or os.path.join(basedir, 'search.db')
+    TILE_CACHE_SIZE = int(os.environ.get('TILE_CACHE_SIZE') or 4096)
+    TILE_CACHE_TTL = int(os.environ.get('TILE_CACHE_TTL') or 60)
+    PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 60))
+    FRAGMENT_CACHE_TTL = int(os.environ.get('FRAGMENT_CACHE_TTL') or 3600)
+    HTTP_CACHE_MAX_AGE = int(os.environ.get('HTTP_CACHE_MAX_AGE', 60))
+    CACHE_L1_SIZE = int(os.environ.get('CACHE_L1_SIZE') or 1024)
+    CACHE_L1_TTL = int(os.environ.get('CACHE_L1_TTL') or 30)
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 4096)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 300)
+    SESSION_BACKEND = os.environ.get('SESSION_BACKEND') or 'cookie'
+    SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', 300))
+    UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE') or 8 * 1024 * 1024)
+    UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS') or 8)
+    UPLOAD_RETRIES = int(os.environ.get('UPLOAD_RETRIES') or 3)
+    UPLOAD_STAGING_DIR = os.environ.get('UPLOAD_STAGING_DIR') or os.path.join(basedir, 'staging')
+    WEB_BUILD_MAX_SIZE = int(os.environ.get('WEB_BUILD_MAX_SIZE') or 1024 * 1024 * 1024)
+    WEB_BUILD_MAX_FILES = int(os.environ.get('WEB_BUILD_MAX_FILES') or 10000)
+    WEB_BUILD_MAX_RATIO = int(os.environ.get('WEB_BUILD_MAX_RATIO') or 100)
+    DATA_EXPORT_BATCH_SIZE = int(os.environ.get('DATA_EXPORT_BATCH_SIZE') or 1000)
+    DATA_EXPORT_LINK_TTL = int(os.environ.get('DATA_EXPORT_LINK_TTL') or 7 * 24 * 60 * 60)
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND') or ('firebase' if GOOGLE_APPLICATION_CREDENTIALS else 'local')
+    LOCAL_STORAGE_PATH = os.environ.get('LOCAL_STORAGE_PATH') or os.path.join(basedir, 'storage')
+    LOCAL_STORAGE_URL = os.environ.get('LOCAL_STORAGE_URL') or '/files'
+    IMAGE_VARIANT_WIDTHS = [320, 640, 960]
+    IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS') or 40000000)
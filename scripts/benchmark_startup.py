@@ -0,0 +1,54 @@
+"""Measure cold start time of the web and worker entry points.
+
+    python scripts/benchmark_startup.py --runs 5 --top 15
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+ENTRY_POINTS = {
+    'web': 'import main',
+    'worker': 'import app.tasks',
+}
+
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run(statement, importtime=False):
+    code = f'import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)'
+    args = [sys.executable, *(['-X', 'importtime'] if importtime else []), '-c', code]
+    result = subprocess.run(args, cwd=basedir, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def _slowest_imports(stderr, top):
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_time, cumulative, name = [part.strip() for part in line[len('import time:'):].split('|')]
+        if cumulative.isdigit():
+            modules.append((int(cumulative), name))
+    return sorted(modules, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('entry_points', nargs='*', default=list(ENTRY_POINTS))
+    args = parser.parse_args()
+
+    for name in args.entry_points:
+        timings = [_run(ENTRY_POINTS[name])[0] for _ in range(args.runs)]
+        print(f'{name}: median {statistics.median(timings) * 1000:.0f} ms, '
+              f'min {min(timings) * 1000:.0f} ms over {args.runs} runs')
+        _, stderr = _run(ENTRY_POINTS[name], importtime=True)
+        for cumulative, module in _slowest_imports(stderr, args.top):
+            print(f'    {cumulative / 1000:8.1f} ms  {module}')
+
+
+if __name__ == '__main__':
+    main()
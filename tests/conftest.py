@@ -0,0 +1,44 @@
+import os
+import tempfile
+import pytest
+import fakeredis
+from sqlalchemy import event
+
+_data_dir = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URI', 'sqlite:///' + os.path.join(_data_dir, 'app.db'))
+os.environ.setdefault('SEARCH_INDEX_PATH', os.path.join(_data_dir, 'search.db'))
+os.environ.setdefault('LOCAL_STORAGE_PATH', os.path.join(_data_dir, 'storage'))
+
+from app import create_app, db
+
+
+@pytest.fixture
+def app():
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False, PAGE_CACHE_TTL=0)
+    app.redis = fakeredis.FakeRedis()
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def queries(app):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', before_cursor_execute)
@@ -0,0 +1,38 @@
+import pytest
+from app import db
+from app.models import User, Game, Comment
+
+
+def _create_game(app, comments):
+    with app.app_context():
+        creator = User(username='creator', email='creator@example.com')
+        game = Game(title='Game', tagline='Tagline', description='Description', cover_url='cover.png',
+                    processing=False, creator=creator)
+        db.session.add(game)
+        for index in range(comments):
+            author = User(username=f'author{index}', email=f'author{index}@example.com')
+            db.session.add(Comment(text=f'Comment {index}', game=game, author=author))
+        db.session.commit()
+        return game.id, game.slug
+
+
+def _count_queries(client, queries, url):
+    queries.clear()
+    response = client.get(url)
+    assert response.status_code == 200
+    return len(queries)
+
+
+@pytest.mark.parametrize('comments', [1, 5, 45])
+def test_game_page_query_count(app, client, queries, comments):
+    id, slug = _create_game(app, comments)
+    assert _count_queries(client, queries, f'/game/{id}/{slug}') == 5
+
+
+@pytest.mark.parametrize('comments', [1, 5, 45])
+def test_game_comments_query_count(app, client, queries, comments):
+    id, _ = _create_game(app, comments)
+    assert _count_queries(client, queries, f'/game/{id}/comments') == 2
+    next_url = client.get(f'/game/{id}/comments').json['next_url']
+    if next_url:
+        assert _count_queries(client, queries, next_url) == 2